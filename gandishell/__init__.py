@@ -16,9 +16,60 @@ Never believe that something is perfect.
 
 __version__ = '0.2.dev'
 
+import atexit
+import os
+import sys
+from argparse import ArgumentParser, FileType
+
+from gandishell.script import read_lines, run_script
 from gandishell.shell import GandiShell
+from gandishell.utils import STATS, STATS_FILE
+
+
+def parse_args():
+    """Read the command line options."""
+    parser = ArgumentParser(prog='gandishell', description="Manage Gandi "
+                            "VMs, with a prompt or from scripts.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('-c', '--command', action='append', default=[],
+                        help="run this command, can be given many times")
+    source.add_argument('-f', '--file', type=FileType('r'),
+                        help="run the commands of this file, - for stdin")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="run up to JOBS consecutive list, info and "
+                        "count commands at the same time")
+    parser.add_argument('-k', '--keep-going', action='store_true',
+                        help="go on after a failed command")
+    parser.add_argument('-s', '--stats', metavar='FILE', default=STATS_FILE,
+                        help="write the stats of the API calls in this "
+                        "JSON file at exit")
+    return parser.parse_args()
 
 
 def main():
-    """Launch the command loop."""
-    GandiShell().cmdloop()
+    """
+    Launch the command loop, or run commands given on the command line, in
+    a file, or piped in stdin, and exit with 1 if one of them failed.
+    """
+    args = parse_args()
+    if args.stats:
+        atexit.register(STATS.export, args.stats)
+    if args.command:
+        lines = args.command
+    elif args.file is not None:
+        lines = read_lines(args.file.read())
+    elif not sys.stdin.isatty():
+        lines = read_lines(sys.stdin.read())
+    else:
+        GandiShell().cmdloop()
+        return
+    try:
+        status = run_script(GandiShell(interactive=False), lines,
+                            max(1, args.jobs), args.keep_going)
+    except KeyboardInterrupt:
+        status = 130
+    except BrokenPipeError:
+        # The reader, like head, wants no more: don't fail writing at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        status = 1
+    sys.exit(status)
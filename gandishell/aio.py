@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+An XML-RPC client for asyncio, keeping many calls in flight on one thread.
+"""
+
+import asyncio
+import gzip
+import ssl
+from time import time
+from urllib.parse import urlparse
+from xmlrpc.client import Fault, ProtocolError, Transport, dumps
+
+from gandishell.decode import getparser
+from gandishell.retry import RetryPolicy
+from gandishell.utils import (ENDPOINT, ASYNC_CONNECTIONS, BREAKER,
+                              CONNECT_TIMEOUT, DEADLINE, LIMITER,
+                              READ_TIMEOUT, RETRIES, STATS)
+
+# Errors telling that the server closed a kept-alive connection.
+STALE_ERRORS = (asyncio.IncompleteReadError, ConnectionError)
+
+
+async def read_response(reader):
+    """
+    Read an HTTP response. Return its status, its reason, its body, if
+    the connection can be used again, and the bytes received for the body.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed by the server")
+    version, status, reason = (status_line.decode('latin-1').rstrip()
+                               .split(' ', 2) + [''])[:3]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    keep_alive = (version == 'HTTP/1.1' and
+                  headers.get('connection', '').lower() != 'close')
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip the trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    size = len(body)
+    if headers.get('content-encoding', '').lower() == 'gzip':
+        body = gzip.decompress(body)
+    return int(status), reason, bytes(body), keep_alive, size
+
+
+# pylint: disable=R0902
+class AsyncTransport(object):
+    """
+    Send requests over persistent HTTP/1.1 connections, opened as needed up
+    to a maximum, each one carrying a call at a time. Calls follow the
+    same RetryPolicy as the PooledTransport, sharing its CircuitBreaker
+    and RateLimiter.
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, url=ENDPOINT, connections=ASYNC_CONNECTIONS,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 stats=STATS, deadline=DEADLINE or None, retries=RETRIES,
+                 breaker=BREAKER, limiter=LIMITER):
+        parts = urlparse(url)
+        self.stats = stats  # A Stats recording the calls, if any
+        self.policy = RetryPolicy(deadline, retries, breaker, limiter, stats)
+        self.host = parts.hostname
+        self.ssl = ssl.create_default_context() \
+            if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.path = parts.path or '/'
+        self.netloc = parts.netloc
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle = []  # Idle connections, the last used first
+        self.slots = asyncio.Semaphore(connections)
+
+    async def connect(self):
+        """Open a new connection."""
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+            self.connect_timeout)
+
+    async def acquire(self):
+        """Get an idle connection, or a new one."""
+        if self.idle:
+            return self.idle.pop(), True
+        return await self.connect(), False
+
+    async def post(self, conn, body):
+        """Send the request on this connection, and read the response."""
+        reader, writer = conn
+        writer.write((
+            'POST {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\n'
+            'Content-Type: text/xml\r\nAccept-Encoding: gzip\r\n'
+            'Content-Length: {}\r\n\r\n').format(
+                self.path, self.netloc, Transport.user_agent,
+                len(body)).encode('latin-1') + body)
+        await writer.drain()
+        return await asyncio.wait_for(read_response(reader),
+                                      self.read_timeout)
+
+    async def request(self, body):
+        """
+        Post the body of a call. Get the body of the response, and the
+        bytes received for it.
+        """
+        async with self.slots:
+            conn, reused = await self.acquire()
+            keep_alive = False
+            try:
+                try:
+                    status, reason, data, keep_alive, size = await self.post(
+                        conn, body)
+                except STALE_ERRORS:
+                    if not reused:
+                        raise
+                    # Kept-alive connection closed by the server: retry once,
+                    # on a new one as the other idle ones may be closed too
+                    conn[1].close()
+                    conn = await self.connect()
+                    status, reason, data, keep_alive, size = await self.post(
+                        conn, body)
+            finally:
+                if keep_alive:
+                    self.idle.append(conn)
+                else:
+                    conn[1].close()
+        if status != 200:
+            raise ProtocolError(self.netloc + self.path, status, reason, {})
+        return data, size
+
+    async def call(self, method, params):
+        """
+        Call the method, and get its result or raise its Fault. Calls wait
+        for the rate limit, fail at once while the circuit is open, and
+        the read ones are retried before the deadline.
+        """
+        body = dumps(params, method).encode('utf-8')
+        call = self.policy.start(method)
+        while True:
+            if call.queue() > 0:
+                await asyncio.sleep(call.queued)
+            with call.attempt():
+                return await asyncio.wait_for(self.call_once(method, body),
+                                              call.time_left())
+            await asyncio.sleep(call.delay)
+
+    async def call_once(self, method, body):
+        """Post the body of a call, and get its result."""
+        start, received = time(), 0
+        fault, error = False, True
+        try:
+            data, received = await self.request(body)
+            parser, unmarshaller = getparser(method, use_datetime=True)
+            parser.feed(data)
+            parser.close()
+            result = unmarshaller.close()[0]
+            error = False
+            return result
+        except Fault:
+            fault, error = True, False
+            raise
+        finally:
+            if self.stats is not None:
+                self.stats.record(method, time() - start, len(body),
+                                  received, fault, error)
+
+    def close(self):
+        """Close all idle connections."""
+        idle, self.idle = self.idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+class AsyncMethod(object):
+    """An API method, called with await, like 'hosting.vm.info'."""
+
+    def __init__(self, transport, name):
+        self.transport = transport
+        self.name = name
+
+    def __getattr__(self, name):
+        return AsyncMethod(self.transport, '{}.{}'.format(self.name, name))
+
+    async def __call__(self, *params):
+        return await self.transport.call(self.name, params)
+
+
+class AsyncProxy(object):
+    """
+    Like ServerProxy, for asyncio: 'await proxy.hosting.vm.info(key, 42)'.
+    Create it and use it in the same event loop.
+    """
+
+    def __init__(self, url=ENDPOINT, transport=None):
+        self.transport = transport or AsyncTransport(url)
+
+    def __getattr__(self, name):
+        return AsyncMethod(self.transport, name)
+
+    def close(self):
+        """Close the connections."""
+        self.transport.close()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Fail fast while the endpoint is unhealthy."""
+
+from threading import Lock
+from time import time
+
+
+class CircuitOpen(ConnectionError):
+    """Raised instead of calling the endpoint, while the circuit is open."""
+
+
+class CircuitBreaker(object):
+    """
+    Count the consecutive failures of the endpoint. After threshold of
+    them, the circuit opens: calls fail at once for cooldown seconds, then
+    a single call tries the endpoint, closing the circuit if it answers.
+    A threshold of 0 never opens it.
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.lock = Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0  # Consecutive ones
+        self.opened_at = None  # While open
+        self.trying = False  # A call is trying the endpoint
+        self.opened = 0  # Times the circuit opened
+
+    def before(self):
+        """Let a call go, or raise CircuitOpen."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            left = self.opened_at + self.cooldown - time()
+            if left > 0 or self.trying:
+                raise CircuitOpen(
+                    "API calls stopped for {:.0f}s after {} failures".format(
+                        max(left, 0), self.failures))
+            self.trying = True
+
+    def success(self):
+        """The endpoint answered, even with a Fault."""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trying = False
+
+    def failure(self):
+        """The endpoint did not answer, or with an HTTP error."""
+        with self.lock:
+            self.failures += 1
+            if self.trying or (self.threshold > 0 and
+                               self.opened_at is None and
+                               self.failures >= self.threshold):
+                if self.opened_at is None:
+                    self.opened += 1
+                self.opened_at = time()
+            self.trying = False
+
+    def cancel(self):
+        """The call stopped for another reason, like Ctrl-C."""
+        with self.lock:
+            self.trying = False
+
+    @property
+    def state(self):
+        """Get 'closed', 'open', or 'half-open' when a call may try."""
+        if self.opened_at is None:
+            return 'closed'
+        if self.opened_at + self.cooldown > time():
+            return 'open'
+        return 'half-open'
+
+    def describe(self):
+        """Get a line telling the state of the circuit."""
+        return "Circuit {}, {} consecutive failures, opened {} times".format(
+            self.state, self.failures, self.opened)
+
+    def to_dict(self):
+        """Get the state as a dict, to export it."""
+        return {'state': self.state, 'failures': self.failures,
+                'opened': self.opened}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""On-disk snapshot of the account and of the stored objects."""
+
+import os
+import pickle
+from hashlib import sha1
+from threading import Lock
+from time import time
+
+from gandishell.utils import APIKEY, CONFIG, ENDPOINT, warning
+
+CACHE_DIR = os.path.expanduser(
+    CONFIG.get('CACHE', 'DIR', fallback='~/.cache/gandishell'))
+DEFAULT_TTL = CONFIG.getint('CACHE', 'TTL', fallback=3600)
+
+
+def human_age(seconds):
+    """Format a duration in seconds as '1h 02m 03s'."""
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return "{}h {:02}m {:02}s".format(hours, minutes, seconds)
+    if minutes:
+        return "{}m {:02}s".format(minutes, seconds)
+    return "{}s".format(seconds)
+
+
+class Snapshot(object):
+    """
+    Data of each type, with the time it was fetched at, saved in a file
+    keyed by the endpoint and the api key.
+    """
+
+    def __init__(self, endpoint=ENDPOINT, apikey=APIKEY):
+        key = sha1('{}\0{}'.format(endpoint, apikey).encode()).hexdigest()
+        self.path = os.path.join(CACHE_DIR, key + '.pickle')
+        self.entries = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def ttl(ttype):
+        """Number of seconds the data of this type is considered fresh."""
+        return CONFIG.getint('CACHE', ttype.__name__, fallback=DEFAULT_TTL)
+
+    def load(self):
+        """Read the snapshot file, if any."""
+        try:
+            with open(self.path, 'rb') as snap:
+                self.entries = pickle.load(snap)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError) as exc:
+            warning("Ignoring unreadable cache {}: {}".format(self.path, exc))
+            self.entries = {}
+
+    def save(self):
+        """Write the snapshot file, readable by its owner only."""
+        with self.lock:
+            entries = dict(self.entries)
+        if not entries:
+            return
+        try:
+            os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+            tmp = self.path + '.tmp'
+            fdesc = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fdesc, 'wb') as snap:
+                pickle.dump(entries, snap, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except OSError as exc:
+            warning("Cannot write cache {}: {}".format(self.path, exc))
+
+    def purge(self):
+        """Forget everything, and remove the snapshot file."""
+        with self.lock:
+            self.entries = {}
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, ttype):
+        """Return the stored data of this type, or None."""
+        try:
+            return self.entries[ttype.__name__][1]
+        except KeyError:
+            return None
+
+    def put(self, ttype, data):
+        """
+        Store fresh data of this type. The objects by id are copied, not
+        to be changed by other threads while they are saved.
+        """
+        if isinstance(data, dict):
+            data = dict(data)
+        with self.lock:
+            self.entries[ttype.__name__] = (time(), data)
+
+    def update(self, ttype, data):
+        """
+        Store data of this type changed here, keeping the time it was
+        fetched at.
+        """
+        if isinstance(data, dict):
+            data = dict(data)
+        with self.lock:
+            fetched = self.entries.get(ttype.__name__, (time(),))[0]
+            self.entries[ttype.__name__] = (fetched, data)
+
+    def age(self, ttype):
+        """Number of seconds since this type was fetched, or None."""
+        try:
+            return time() - self.entries[ttype.__name__][0]
+        except KeyError:
+            return None
+
+    def is_stale(self, ttype):
+        """Tell if the data of this type should be fetched again."""
+        age = self.age(ttype)
+        return age is None or age > self.ttl(ttype)
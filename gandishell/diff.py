@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compare two versions of the objects of a type."""
+
+from gandishell.render import paint
+
+
+def name_of(ttype, obj):
+    """Get the name of an object, or its id."""
+    if ttype.name_key:
+        return str(obj.get(ttype.name_key) or obj['id'])
+    return str(obj['id'])
+
+
+class Diff(object):
+    """
+    The objects added, removed, and the fields changed, by id. Only the
+    fields of both versions are compared: an object refreshed with its
+    info has more of them than in a list.
+    """
+
+    def __init__(self, old, new):
+        self.added = [new[obj_id] for obj_id in sorted(new)
+                      if obj_id not in old]
+        self.removed = [old[obj_id] for obj_id in sorted(old)
+                        if obj_id not in new]
+        self.changed = {}  # (old value, new value) by field, by id
+        for obj_id, obj in new.items():
+            before = old.get(obj_id)
+            if before is None or before == obj:
+                continue
+            fields = {key: (before[key], obj[key]) for key in before
+                      if key in obj and before[key] != obj[key]}
+            if fields:
+                self.changed[obj_id] = fields
+        self.new = new
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self, ttype, limit=3):
+        """Get a line telling what changed, naming a few objects."""
+        def some(texts):
+            """Join the first texts, telling how many others there are."""
+            more = len(texts) - limit
+            return ', '.join(texts[:limit]) + (
+                ' and {} more'.format(more) if more > 0 else '')
+        parts = []
+        if self.changed:
+            parts.append('changed ' + some([
+                '{} {}'.format(name_of(ttype, self.new[obj_id]), ' '.join(
+                    '{} {} -> {}'.format(key, before, after)
+                    for key, (before, after) in sorted(fields.items())))
+                for obj_id, fields in sorted(self.changed.items())]))
+        if self.added:
+            parts.append('new ' + some([name_of(ttype, obj)
+                                        for obj in self.added]))
+        if self.removed:
+            parts.append('gone ' + some([name_of(ttype, obj)
+                                         for obj in self.removed]))
+        return '{}: {}'.format(ttype.__name__, '; '.join(parts))
+
+    def lines(self, ttype):
+        """Get a line by object added or removed, and by field changed."""
+        def head(sign, color, obj):
+            """Start a line about an object."""
+            return '{} {} {}({})'.format(paint(sign, color, None, ('bold',)),
+                                         ttype.__name__, name_of(ttype, obj),
+                                         obj['id'])
+        lines = [head('+', 'green', obj) for obj in self.added]
+        lines += [head('-', 'red', obj) for obj in self.removed]
+        for obj_id, fields in sorted(self.changed.items()):
+            start = head('~', 'yellow', self.new[obj_id])
+            for key, (before, after) in sorted(fields.items()):
+                lines.append('{} {}: {} -> {}'.format(
+                    start, paint(key, 'grey', None, ('bold',)), before, after))
+        return lines
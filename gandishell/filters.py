@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Select objects with predicates on their fields, like 'state=running'."""
+
+import operator
+import re
+
+# Longest first, so '!=' is not read as '='
+OPERATORS = [('!=', operator.ne), ('>=', operator.ge), ('<=', operator.le),
+             ('=', operator.eq), ('>', operator.gt), ('<', operator.lt),
+             ('~', None)]
+PREDICATE_RE = re.compile(r'^(\w+)({})(.*)$'.format(
+    '|'.join(re.escape(sign) for sign, _ in OPERATORS)))
+
+
+def coerce(value, like):
+    """Convert the string value to the type of the field it is compared to."""
+    if value.lower() == 'none':
+        return None
+    if isinstance(like, bool):
+        return value.lower() in ['1', 'true', 'yes']
+    if isinstance(like, (int, float)):
+        return type(like)(value)
+    return value
+
+
+class Predicate(object):
+    """A condition on one field of an object."""
+
+    def __init__(self, key, sign, value):
+        self.key = key
+        self.sign = sign
+        self.value = value
+        self.func = dict(OPERATORS)[sign]
+        if sign == '~':
+            try:
+                self.regex = re.compile(value, re.I)
+            except re.error as exc:
+                raise ValueError("{}: {}".format(value, exc))
+
+    def __repr__(self):
+        return "{}{}{}".format(self.key, self.sign, self.value)
+
+    @classmethod
+    def parse(cls, token):
+        """Get the predicate written in token, or None."""
+        found = PREDICATE_RE.match(token)
+        if found is None:
+            return None
+        return cls(*found.groups())
+
+    def __call__(self, obj):
+        field = obj.get(self.key)
+        if self.sign == '~':
+            return self.regex.search(str(field)) is not None
+        try:
+            return self.func(field, coerce(self.value, field))
+        except (TypeError, ValueError):
+            return False
+
+
+def pop_predicates(tokens):
+    """
+    Remove '--where' and the predicates following it from tokens, and
+    return these predicates (None without '--where'). Raise ValueError if
+    none follows it.
+    """
+    if '--where' not in tokens:
+        return None
+    start = end = tokens.index('--where')
+    predicates = []
+    for token in tokens[start + 1:]:
+        predicate = Predicate.parse(token)
+        if predicate is None:
+            break
+        predicates.append(predicate)
+        end += 1
+    if not predicates:
+        raise ValueError("--where needs predicates")
+    del tokens[start:end + 1]
+    return predicates
+
+
+def match(obj, predicates):
+    """Tell if the object satisfies all the predicates."""
+    return all(predicate(obj) for predicate in predicates)
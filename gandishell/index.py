@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Indexes over the stored objects, built once for each refresh."""
+
+import re
+from bisect import bisect_left
+
+WORD_RE = re.compile(r'\w+(?:\.\w+)*')
+
+
+def tokenize(text):
+    """Split a text in lowercase words, keeping versions like '14.04'."""
+    return WORD_RE.findall(str(text).lower())
+
+
+class ImageIndex(object):
+    """
+    Images grouped by datacenter, with the words of their label, OS and
+    version fields sorted for prefix lookups.
+    """
+
+    fields = ['label', 'os_arch', 'kernel_version', 'version']
+
+    def __init__(self, images, ttype=None):  # pylint: disable=W0613
+        self.images = images
+        self.by_datacenter = {}
+        self.by_word = {}
+        for image in images.values():
+            self.by_datacenter.setdefault(image.get('datacenter_id'),
+                                          set()).add(image['id'])
+            for field in self.fields:
+                if image.get(field) is None:
+                    continue
+                for word in tokenize(image[field]):
+                    self.by_word.setdefault(word, set()).add(image['id'])
+        self.words = sorted(self.by_word)
+
+    def prefixed(self, prefix):
+        """Get the ids of the images having a word starting with prefix."""
+        ids = set()
+        start = bisect_left(self.words, prefix)
+        for word in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            ids |= self.by_word[word]
+        return ids
+
+    def search(self, query='', datacenter_id=None):
+        """
+        Get the images of the datacenter (all of them if None) having, for
+        each word of the query, a word starting with it. Sorted by id.
+        """
+        if datacenter_id is None:
+            ids = set(self.images)
+        else:
+            ids = set(self.by_datacenter.get(datacenter_id, ()))
+        for prefix in tokenize(query):
+            if not ids:
+                break
+            ids &= self.prefixed(prefix)
+        return [self.images[i] for i in sorted(ids)]
+
+
+class CompletionIndex(object):
+    """
+    The ids of objects, and their names (name_key of their type), as
+    sorted strings for prefix lookups, with the id each one stands for.
+    Names with spaces, which can not be typed as one word, are left out.
+    """
+
+    def __init__(self, objs, ttype):
+        entries = [(str(obj_id), obj_id) for obj_id in objs]
+        if ttype.name_key is not None:
+            for obj_id, obj in objs.items():
+                name = str(obj.get(ttype.name_key) or '')
+                if name and len(name.split()) == 1:
+                    entries.append((name, obj_id))
+        entries.sort()
+        self.words = [word for word, _ in entries]
+        self.ids = [obj_id for _, obj_id in entries]
+        self.completions = [word + ' ' for word in self.words]
+
+    def span(self, prefix):
+        """Get the slice of the words starting with prefix."""
+        start = bisect_left(self.words, prefix)
+        return start, bisect_left(self.words, prefix + '\U0010ffff', start)
+
+    def complete(self, prefix):
+        """
+        Get the words starting with prefix, or the id they all stand for
+        if they name a single object.
+        """
+        start, end = self.span(prefix)
+        if start == end:
+            return []
+        first = self.ids[start]
+        if self.ids[start:end].count(first) == end - start:
+            return [str(first) + ' ']
+        return self.completions[start:end]
+
+
+class FieldIndex(object):
+    """
+    The ids of objects by the values of some of their fields (lookup_keys
+    of their type), like VMs by hostname. Kept up to date object by
+    object, instead of being built again.
+    """
+
+    def __init__(self, objs, ttype):
+        self.by_field = {field: {} for field in ttype.lookup_keys}
+        for obj in objs.values():
+            self.add(obj)
+
+    def add(self, obj):
+        """Index an object."""
+        for field, ids in self.by_field.items():
+            value = obj.get(field)
+            if value is not None:
+                ids.setdefault(value, set()).add(obj['id'])
+
+    def remove(self, obj):
+        """Forget an object."""
+        for field, ids in self.by_field.items():
+            found = ids.get(obj.get(field))
+            if found is not None:
+                found.discard(obj['id'])
+                if not found:
+                    del ids[obj.get(field)]
+
+    def replace(self, old, new):
+        """Index new instead of old, which may be None."""
+        if old is not None:
+            if all(old.get(field) == new.get(field)
+                   for field in self.by_field):
+                return
+            self.remove(old)
+        self.add(new)
+
+    def update(self, old_objs, new_objs):
+        """Index new objects by id, instead of the old ones."""
+        for obj_id, obj in old_objs.items():
+            if obj_id not in new_objs:
+                self.remove(obj)
+        for obj_id, obj in new_objs.items():
+            self.replace(old_objs.get(obj_id), obj)
+
+    def find(self, field, text):
+        """Get the ids of the objects having this value (a string)."""
+        ids = self.by_field[field]
+        found = ids.get(text)
+        if found is None and text.lstrip('-').isdigit():
+            found = ids.get(int(text))
+        return set(found or ())
+
+    def resolve(self, text):
+        """Get the ids of the objects having this value in any field."""
+        ids = set()
+        for field in self.by_field:
+            ids |= self.find(field, text)
+        return ids
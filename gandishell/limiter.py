@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Keep the calls under the request rate allowed by the API."""
+
+from threading import Lock
+from time import monotonic, sleep
+
+
+# pylint: disable=R0902
+class RateLimiter(object):
+    """
+    A token bucket shared by all the calls: it holds at most burst tokens,
+    refilled by rate a second, and a call takes the weight of its method
+    (1 by default). Each caller reserves its tokens in turn, and waits
+    until they are refilled, so callers are served in order instead of
+    failing. A rate of 0 does not limit anything.
+    """
+
+    def __init__(self, rate=0, burst=1, weights=None):
+        self.lock = Lock()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.weights = weights or {}
+        self.tokens = self.burst  # Negative when reserved ahead
+        self.last = monotonic()
+        self.waits = 0
+        self.waited = 0.0
+
+    def weight(self, method, calls=1):
+        """
+        Get the tokens of a call of the method, which may be a multicall
+        of calls, like 'system.multicall:hosting.vm.info'.
+        """
+        if method is None:
+            return 1
+        inner = method.rsplit(':', 1)[-1]
+        if inner != method:
+            return self.weights.get(inner, 1) * max(calls, 1)
+        return self.weights.get(method, 1)
+
+    def reserve(self, tokens):
+        """Take tokens from the bucket, and get the seconds to wait."""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            delay = -self.tokens / self.rate
+            self.waits += 1
+            self.waited += delay
+            return delay
+
+    def delay(self, method, calls=1):
+        """Take the tokens of a call, and get the seconds to wait for them."""
+        if self.rate <= 0:
+            return 0
+        return self.reserve(self.weight(method, calls))
+
+    def acquire(self, method, calls=1):
+        """Wait until a call of the method is allowed."""
+        delay = self.delay(method, calls)
+        if delay > 0:
+            sleep(delay)
+
+    def describe(self):
+        """Get a line telling the limit, and how long the calls waited."""
+        if self.rate <= 0:
+            return "Rate not limited"
+        return "Rate limited to {:g} tokens/s, burst {:g}: {} calls " \
+               "waited {:.1f}s".format(self.rate, self.burst, self.waits,
+                                       self.waited)
+
+    def to_dict(self):
+        """Get the limit and the waits as a dict, to export them."""
+        return {'rate': self.rate, 'burst': self.burst, 'waits': self.waits,
+                'waited_seconds': round(self.waited, 3)}
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Remember the results of the read calls of the API for a while."""
+
+from collections import Counter, OrderedDict
+from threading import Lock
+from time import time
+
+from gandishell.decode import is_read
+from gandishell.utils import get_number, CONFIG
+
+# Namespaces whose objects show each other, like the disks in the info of
+# a VM: a change of one of them changes the others.
+LINKED = [('hosting.vm', 'hosting.disk', 'hosting.iface', 'hosting.ip')]
+# Changing anything creates operations, and costs credits
+ALWAYS_CHANGED = ('operation', 'hosting.account')
+# Seconds to remember a method, when not the default TTL
+TTLS = {'hosting.datacenter.list': 3600, 'hosting.image.list': 3600,
+        # Operations are polled to wait for them, they must be fresh
+        'operation.count': 0, 'operation.info': 0, 'operation.list': 0}
+
+
+def changed_namespaces(method):
+    """Get the namespaces which a call of the method may change."""
+    namespace = method.rsplit('.', 1)[0]
+    namespaces = {namespace}
+    for linked in LINKED:
+        if namespace in linked:
+            namespaces.update(linked)
+    return namespaces.union(ALWAYS_CHANGED)
+
+
+class Memo(object):
+    """
+    The results of the read calls, by method and params, kept ttl seconds,
+    and at most size by method, the least recently used being dropped.
+    """
+
+    def __init__(self, ttl, size, ttls=None):
+        self.lock = Lock()
+        self.ttl = ttl
+        self.size = size
+        self.ttls = ttls or {}
+        self.entries = {}  # (expiry, result) by params, by method
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def ttl_of(self, method):
+        """Get the seconds to remember the results of a method."""
+        return self.ttls.get(method, self.ttl)
+
+    def get(self, method, key):
+        """Get (True, result) of a call remembered, or (False, None)."""
+        with self.lock:
+            entries = self.entries.get(method)
+            entry = entries.get(key) if entries else None
+            if entry is None or entry[0] < time():
+                self.misses[method] += 1
+                return False, None
+            entries.move_to_end(key)
+            self.hits[method] += 1
+            return True, entry[1]
+
+    def put(self, method, key, result):
+        """Remember the result of a call, if the method is remembered."""
+        ttl = self.ttl_of(method)
+        if ttl <= 0 or self.size <= 0:
+            return
+        with self.lock:
+            entries = self.entries.setdefault(method, OrderedDict())
+            entries[key] = (time() + ttl, result)
+            entries.move_to_end(key)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def forget(self, namespaces=None):
+        """Forget the results of the methods of namespaces, or all."""
+        with self.lock:
+            if namespaces is None:
+                self.entries.clear()
+                return
+            for method in list(self.entries):
+                if method.rsplit('.', 1)[0] in namespaces:
+                    del self.entries[method]
+
+    def reset(self):
+        """Forget the hits and misses."""
+        with self.lock:
+            self.hits.clear()
+            self.misses.clear()
+
+    def lines(self):
+        """Get a table of the hits and misses, as lines of text."""
+        with self.lock:
+            methods = sorted(set(self.hits) | set(self.misses))
+            lines = ["{:<32} {:>6} {:>6} {:>7} {:>6}".format(
+                'remembered', 'hits', 'misses', 'entries', 'ttl')]
+            for method in methods:
+                lines.append("{:<32} {:>6} {:>6} {:>7} {:>6g}".format(
+                    method[:32], self.hits[method], self.misses[method],
+                    len(self.entries.get(method, ())),
+                    self.ttl_of(method)))
+        return lines if methods else []
+
+
+class MemoMethod(object):
+    """A method of a MemoProxy, like 'hosting.vm.info'."""
+    __slots__ = ('proxy', 'name')
+
+    def __init__(self, proxy, name):
+        self.proxy = proxy
+        self.name = name
+
+    def __getattr__(self, name):
+        return MemoMethod(self.proxy, '{}.{}'.format(self.name, name))
+
+    def __call__(self, *params):
+        return self.proxy.call(self.name, params)
+
+
+class MemoProxy(object):
+    """
+    Wrap a ServerProxy: the results of the read methods are remembered in
+    a Memo, and calls changing something make it forget what they change.
+    system.multicall goes straight to the API, for fresh data in batches.
+    """
+
+    def __init__(self, api, memo):
+        self.api = api
+        self.memo = memo
+
+    def __getattr__(self, name):
+        return MemoMethod(self, name)
+
+    def call(self, method, params):
+        """Call a method, or get its remembered result."""
+        func = getattr(self.api, method)
+        if method.startswith('system.'):
+            return func(*params)
+        if not is_read(method):
+            try:
+                return func(*params)
+            finally:
+                self.memo.forget(changed_namespaces(method))
+        key = repr(params)
+        found, res = self.memo.get(method, key)
+        if not found:
+            res = func(*params)
+            self.memo.put(method, key, res)
+        return res
+
+
+def memo_ttls():
+    """Get the TTLs by method, the defaults updated by the MEMO section."""
+    ttls = dict(TTLS)
+    if CONFIG.has_section('MEMO'):
+        for method in CONFIG['MEMO']:
+            if '.' in method:
+                ttls[method] = get_number(method, 0, 'MEMO', float)
+    return ttls
+
+
+MEMO = Memo(get_number('TTL', 10, 'MEMO', float),
+            get_number('SIZE', 256, 'MEMO'), memo_ttls())
@@ -13,44 +13,200 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """Basic objects representation."""
 
+from asyncio import ensure_future, gather
+from collections import Counter
 from getpass import getpass
 from subprocess import call
+from time import sleep, time
+from xmlrpc.client import Fault
 from termcolor import colored
 
-from gandishell.utils import (APIKEY,
-                              ask_int, ask_string,
-                              bold, error, info, warning,
-                              catch_fault, print_iter
+from gandishell.decode import register, register_type
+from gandishell.filters import match
+from gandishell.index import CompletionIndex, ImageIndex
+from gandishell.record import Record
+from gandishell.render import paint
+from gandishell.utils import (APIKEY, PAGE_SIZE, WAIT_TIMEOUT,
+                              ask_int, ask_string, backoff,
+                              bold, error, info, progress, warning,
+                              catch_fault, iter_pages, multicall, pop_option,
+                              print_iter
                               )
 
 
-class DataObject(dict):
+class DataObject(Record):
     """Ancestor of all Gandi-related objects, for common things."""
+    __slots__ = ()  # Keep them as small as a Record
     hidden_keys = ['id']  # Showed by template
     str_tmpl = "* {ttype}(" + colored('{id}',
                                       'yellow', attrs=['bold']) + "): {data}"
+    namespace = None  # Prefix of the API methods, like 'hosting.vm'
+    batch_token = ['info']  # Instance actions done on many objects at once
+    single_token = []  # Instance actions done on a single object only
+    list_options = {}  # Fields the list method can filter, with their type
+    store_token = []  # Class actions using the stored objects
+    name_key = None  # Field naming the objects for humans, like 'hostname'
+    lookup_keys = []  # Fields to find the objects by, in a FieldIndex
+    index_class = CompletionIndex  # Default index of the stored objects
 
     def __str__(self):
-        ttype = self.__class__.__name__
-        data = ''
-        for key, value in self.items():
-            if key not in self.hidden_keys:
-                data += "\n*\t{}: {}".format(colored(key,
-                                                     'grey', attrs=['bold']),
-                                             value)
-        return self.str_tmpl.format(ttype=colored(ttype,
-                                                  'red', attrs=['bold']),
-                                    data=data, **self)
+        return self.render()
+
+    def render(self, fields=None):
+        """Get the text showing this object, only some fields if given."""
+        keys = self if fields is None else [key for key in fields
+                                            if key in self]
+        data = ''.join(
+            "\n*\t{}: {}".format(paint(key, 'grey', None, ('bold',)),
+                                 self[key])
+            for key in keys if key not in self.hidden_keys)
+        ttype = paint(self.__class__.__name__, 'red', None, ('bold',))
+        return self.str_tmpl.format(ttype=ttype, data=data, id=self.get('id'))
 
     def __repr__(self):
         tmpl = "{name}({content})"
         name = self.__class__.__name__
-        content = dict.__repr__(self)
+        content = repr(dict(self))
         return tmpl.format(name=name, content=content)
 
+    @classmethod
+    def build(cls, data):
+        """
+        Get an object from the data of the API, which may already be one
+        when it was decoded as such.
+        """
+        return data if isinstance(data, cls) else cls(data)
+
+    @classmethod
+    def iter(cls, api, options=None):
+        """
+        Yield the existing objects, downloaded page by page while they are
+        used.
+        """
+        for item in iter_pages(api, cls.namespace + '.list', options):
+            yield cls.build(item)
+
+    @classmethod
+    def search(cls, api, predicates=(), sort=None):
+        """
+        Yield the existing objects satisfying the predicates, sorted by a
+        field (descending with a leading '-'). Filters and sorts are done
+        by the API when it can, here otherwise.
+        """
+        options, others = {}, []
+        for predicate in predicates:
+            kind = cls.list_options.get(predicate.key)
+            if predicate.sign == '=' and kind is not None \
+                    and predicate.key not in options:
+                try:
+                    options[predicate.key] = kind(predicate.value)
+                    continue
+                except ValueError:
+                    pass
+            others.append(predicate)
+        if sort in cls.list_options:
+            options['sort_by'] = sort
+            sort = None
+        objs = (obj for obj in cls.iter(api, options) if match(obj, others))
+        if sort is None:
+            return objs
+        key = sort.lstrip('-')
+        return iter(sorted(objs, reverse=sort.startswith('-'),
+                           key=lambda obj: (obj.get(key) is None,
+                                            obj.get(key))))
+
+    @classmethod
+    def fetch(cls, api, ids):
+        """
+        Get fresh data about many objects, in batches of system.multicall.
+        Return the objects by id, and the faults by id.
+        """
+        res, faults = {}, {}
+        calls = [(APIKEY, obj_id) for obj_id in ids]
+        method = cls.namespace + '.info'
+        for obj_id, data in zip(ids, multicall(api, method, calls)):
+            if isinstance(data, Fault):
+                faults[obj_id] = data
+            else:
+                res[obj_id] = cls.build(data)
+        return res, faults
+
+    @classmethod
+    def batch_info(cls, api, objs):
+        """Get info about many objects, reporting faults one by one."""
+        ids = [obj['id'] for obj in objs]
+        info("Info about {} {}".format(cls.__name__,
+                                       ', '.join(str(i) for i in ids)))
+        with catch_fault():
+            res, faults = cls.fetch(api, ids)
+            for obj_id, exc in faults.items():
+                error("An XMLRPC error {} occured on {}({}): {}".format(
+                      exc.faultCode, cls.__name__, obj_id, exc.faultString))
+            return res
+
+    ######## asyncio, with an AsyncProxy ########
+    @classmethod
+    async def alist(cls, proxy, options=None):
+        """Get the existing objects by id, the next page fetched ahead."""
+        def fetch(page):
+            """Start to get the items of a page."""
+            opts = dict(options or {}, items_per_page=PAGE_SIZE, page=page)
+            return ensure_future(getattr(proxy, cls.namespace + '.list')(
+                APIKEY, opts))
+        res, page, future = {}, 0, fetch(0)
+        while future is not None:
+            items = await future
+            if len(items) < PAGE_SIZE:
+                future = None
+            else:
+                page += 1
+                future = fetch(page)
+            for item in items:
+                res[item['id']] = cls.build(item)
+        return res
+
+    @classmethod
+    async def acount(cls, proxy):
+        """Get the number of existing objects."""
+        return await getattr(proxy, cls.namespace + '.count')(APIKEY)
+
+    @classmethod
+    async def afetch(cls, proxy, ids):
+        """
+        Like fetch, with all the calls in flight at once. Return the
+        objects by id, and the faults by id.
+        """
+        method = getattr(proxy, cls.namespace + '.info')
+        results = await gather(*[method(APIKEY, obj_id) for obj_id in ids],
+                               return_exceptions=True)
+        res, faults = {}, {}
+        for obj_id, data in zip(ids, results):
+            if isinstance(data, Fault):
+                faults[obj_id] = data
+            elif isinstance(data, Exception):
+                raise data
+            else:
+                res[obj_id] = cls.build(data)
+        return res, faults
+
+    async def ainfo(self, proxy):
+        """Get fresh data about this object."""
+        return self.build(await getattr(proxy, self.namespace + '.info')(
+            APIKEY, self['id']))
+
+    async def aaction(self, proxy, token, *args):
+        """
+        Run an action returning an operation, like 'reboot', or
+        'disk_attach' with a disk id.
+        """
+        res = await getattr(proxy, '{}.{}'.format(self.namespace, token))(
+            APIKEY, self['id'], *args)
+        return Operation.build(res)
+
 
 class Account(DataObject):
     """The account itself."""
+    __slots__ = ()
 
     hidden_keys = ['id',  # Showed by template
                    'share_definition', 'products',  # Useless
@@ -58,37 +214,47 @@ class Account(DataObject):
                    ]
 
     def __init__(self, api):
-        super().__init__(**api.hosting.account.info(APIKEY))
+        super().__init__(api.hosting.account.info(APIKEY))
 
     def refresh(self, api):
         """Get fresh data about account state."""
-        self.clear()
-        self.update(**api.hosting.account.info(APIKEY))
+        data = api.hosting.account.info(APIKEY)
+        self.replace(tuple(data), tuple(data.values()))
 
 
 class Datacenter(DataObject):
     """The image itself."""
+    __slots__ = ()
 
     class_token = ['list']
     instance_token = []
     all_token = class_token + instance_token
+    namespace = 'hosting.datacenter'
+    name_key = 'name'
+    list_options = {'id': int, 'iso': str, 'name': str}
 
     ############# classmethods #############
     @classmethod
     def list(cls, api):
         """Get a list of existing datacenters."""
         res = {}
-        for datacenter in api.hosting.datacenter.list(APIKEY):
-            res[datacenter['id']] = Datacenter(**datacenter)
+        for datacenter in cls.iter(api):
+            res[datacenter['id']] = datacenter
         return res
 
 
 class Disk(DataObject):
     """The disk itself."""
+    __slots__ = ()
 
     class_token = ['count', 'list']
     instance_token = ['delete', 'info']
     all_token = class_token + instance_token
+    namespace = 'hosting.disk'
+    name_key = 'name'
+    lookup_keys = ['name']
+    list_options = {'id': int, 'name': str, 'state': str, 'type': str,
+                    'datacenter_id': int}
 
     ############# classmethods #############
     @classmethod
@@ -104,8 +270,8 @@ class Disk(DataObject):
         """Get a list of existing disks."""
         res = {}
         with catch_fault():
-            for disk in api.hosting.disk.list(APIKEY):
-                res[disk['id']] = Disk(**disk)
+            for disk in cls.iter(api):
+                res[disk['id']] = disk
             return res
 
     ########### id only commands ###########
@@ -114,7 +280,7 @@ class Disk(DataObject):
         info("Deleting Disk {}".format(self['id']))
         with catch_fault():
             res = api.hosting.disk.delete(APIKEY, self['id'])
-            ope = Operation(**res)
+            ope = Operation.build(res)
             return ope
 
     def info(self, api):
@@ -122,15 +288,20 @@ class Disk(DataObject):
         info("Info about Disk {}".format(self['id']))
         with catch_fault():
             res = api.hosting.disk.info(APIKEY, self['id'])
-            return Disk(**res)
+            return Disk.build(res)
 
 
 class Iface(DataObject):
     """An Interface."""
+    __slots__ = ()
 
     class_token = ['count', 'list']
     instance_token = ['info']
     all_token = class_token + instance_token
+    namespace = 'hosting.iface'
+    lookup_keys = ['vm_id']
+    list_options = {'id': int, 'vm_id': int, 'state': str, 'type': str,
+                    'datacenter_id': int}
 
     ############# classmethods #############
     @classmethod
@@ -146,8 +317,8 @@ class Iface(DataObject):
         """Get a list of existing Interfaces."""
         res = {}
         with catch_fault():
-            for iface in api.hosting.iface.list(APIKEY):
-                res[iface['id']] = Iface(**iface)
+            for iface in cls.iter(api):
+                res[iface['id']] = iface
             return res
 
     ########### id only commands ###########
@@ -156,56 +327,65 @@ class Iface(DataObject):
         info("Info about Interface {}".format(self['id']))
         with catch_fault():
             res = api.hosting.iface.info(APIKEY, self['id'])
-            return Iface(**res)
+            return Iface.build(res)
 
 
 class Image(DataObject):
     """The image itself."""
+    __slots__ = ()
 
     class_token = ['list']
     instance_token = ['info']
     all_token = class_token + instance_token
+    namespace = 'hosting.image'
+    name_key = 'label'
+    lookup_keys = ['label']
+    index_class = ImageIndex
+    list_options = {'id': int, 'label': str, 'os_arch': str,
+                    'visibility': str, 'datacenter_id': int}
 
     ############# classmethods #############
     @classmethod
     def list(cls, api):
         """Get a list of existing disks images."""
         res = {}
-        for image in api.hosting.image.list(APIKEY):
-            res[image['id']] = Image(**image)
+        for image in cls.iter(api):
+            res[image['id']] = image
         return res
 
     @classmethod
-    def filter(cls, api, datacenter_id):
-        """Select an image by filtering on his name."""
-        images = {k: v for k, v in cls.list(api).items()
-                  if v['datacenter_id'] == datacenter_id}
-        for k, v in images.items():
-            print(k, v)
-        while len(images) > 1:
+    def filter(cls, images, datacenter_id, query=''):
+        """
+        Select an image of the datacenter in the ImageIndex, narrowing the
+        choice with the words of the query, then with keywords asked.
+        """
+        candidates = images.search(query, datacenter_id)
+        if not candidates:
+            warning("No image matches \"{}\"".format(query))
+            query = ''
+            candidates = images.search(query, datacenter_id)
+        while len(candidates) > 1:
+            print_iter(candidates)
             _ = "an id or a keyword, as we still have {} possible disk images."
-            keyword = ask_string(_.format(len(images)), '')
+            keyword = ask_string(_.format(len(candidates)), '')
             try:
-                keyword = int(keyword)
-                if keyword not in images:
-                    warning("{} is not a valid id".format(keyword))
-                else:
-                    image = images[keyword]
+                image_id = int(keyword)
+                if image_id in [image['id'] for image in candidates]:
+                    candidates = [images.images[image_id]]
                     break
             except ValueError:
-                filtered = {k: v for k, v in images.items()
-                            if keyword in v['label']}
-                if not len(filtered):
-                    warning("No label contains \"{}\"".format(keyword))
-                    continue
-                elif len(filtered) is 1:
-                    image = filtered.popitem()[1]
-                    break
-                else:
-                    images = filtered
-                    for _, v in images.items():
-                        print(v)
-                    continue
+                pass
+            # Not an id: look for it in labels, OS and versions
+            narrowed = images.search(query + ' ' + keyword, datacenter_id)
+            if not narrowed:
+                warning("No image matches \"{}\"".format(keyword))
+                continue
+            query += ' ' + keyword
+            candidates = narrowed
+        if not candidates:
+            error("No image in datacenter {}".format(datacenter_id))
+            return None
+        image = candidates[0]
         info('Image selected :')
         print(image)
         return image['disk_id']
@@ -216,15 +396,21 @@ class Image(DataObject):
         info("Info about Image {}".format(self['id']))
         with catch_fault():
             res = api.hosting.image.info(APIKEY, self['id'])
-        return Image(**res)
+        return Image.build(res)
 
 
 class Ip(DataObject):
     """An IP address."""
+    __slots__ = ()
 
     class_token = ['count', 'list']
     instance_token = ['info']
     all_token = class_token + instance_token
+    namespace = 'hosting.ip'
+    name_key = 'ip'
+    lookup_keys = ['ip']
+    list_options = {'id': int, 'ip': str, 'version': int, 'state': str,
+                    'datacenter_id': int}
 
     ############# classmethods #############
     @classmethod
@@ -240,8 +426,8 @@ class Ip(DataObject):
         """Get a list of existing IPs."""
         res = {}
         with catch_fault():
-            for ip_addr in api.hosting.ip.list(APIKEY):
-                res[ip_addr['id']] = Ip(**ip_addr)
+            for ip_addr in cls.iter(api):
+                res[ip_addr['id']] = ip_addr
             return res
 
     ########### id only commands ###########
@@ -250,15 +436,21 @@ class Ip(DataObject):
         info("Info about IP {}".format(self['id']))
         with catch_fault():
             res = api.hosting.ip.info(APIKEY, self['id'])
-            return Ip(**res)
+            return Ip.build(res)
 
 
 class Operation(DataObject):
     """The operation itself."""
+    __slots__ = ()
 
     class_token = ['count', 'list']
-    instance_token = ['info']
+    instance_token = ['info', 'wait']
     all_token = class_token + instance_token
+    namespace = 'operation'
+    lookup_keys = ['step', 'type']
+    list_options = {'id': int, 'step': str, 'type': str}
+    batch_token = ['info', 'wait']
+    terminal_steps = ['CANCEL', 'DONE', 'ERROR', 'SUPPORT']
 
     ############# classmethods #############
     @classmethod
@@ -274,8 +466,8 @@ class Operation(DataObject):
         """Get a list of existing Operation."""
         res = {}
         with catch_fault():
-            for oper in api.operation.list(APIKEY):
-                res[oper['id']] = Operation(**oper)
+            for oper in cls.iter(api):
+                res[oper['id']] = oper
             return res
 
     ########### id only commands ###########
@@ -284,16 +476,67 @@ class Operation(DataObject):
         info("Info about Operation {}".format(self['id']))
         with catch_fault():
             res = api.operation.info(APIKEY, self['id'])
-            return Operation(**res)
+            return Operation.build(res)
+
+    def wait(self, api):
+        """Wait for this Operation to end."""
+        return self.batch_wait(api, [self]).get(self['id'])
+
+    @classmethod
+    def batch_wait(cls, api, opes, timeout=WAIT_TIMEOUT):
+        """
+        Poll the given operations until they all reach a terminal step,
+        or until the timeout. Return their last known state, by id.
+        """
+        res = {ope['id']: ope for ope in opes}
+        start = time()
+        delays = backoff()
+        text = ''
+        with catch_fault():
+            while True:
+                pending = [ope['id'] for ope in res.values()
+                           if ope['step'] not in cls.terminal_steps]
+                steps = Counter(ope['step'] for ope in res.values())
+                text = "Waiting for {} operations: {} ({:.0f}s)".format(
+                    len(res), ', '.join('{} {}'.format(count, step)
+                                        for step, count in sorted(
+                                            steps.items())),
+                    time() - start)
+                progress(text)
+                remaining = start + timeout - time()
+                if not pending or remaining <= 0:
+                    break
+                sleep(min(next(delays), remaining))
+                # One multicall for all the pending operations
+                fresh, faults = cls.fetch(api, pending)
+                res.update(fresh)
+                for ope_id, exc in faults.items():
+                    error("An XMLRPC error {} occured on {}({}): {}".format(
+                          exc.faultCode, cls.__name__, ope_id,
+                          exc.faultString))
+                    res.pop(ope_id)
+        progress(text, done=True)
+        if pending:
+            warning("Timeout: {} operations are still pending.".format(
+                len(pending)))
+        return res
 
 
 class VirtualMachine(DataObject):
     """The virtual-machine itself."""
+    __slots__ = ()
 
     class_token = ['count', 'list', 'create']
+    store_token = ['create']
     instance_token = ['connect', 'delete', 'info', 'start', 'stop', 'reboot',
                       'disk_attach', 'disk_detach']
     all_token = class_token + instance_token
+    namespace = 'hosting.vm'
+    name_key = 'hostname'
+    lookup_keys = ['hostname']
+    list_options = {'id': int, 'hostname': str, 'state': str,
+                    'datacenter_id': int}
+    single_token = ['connect', 'disk_attach', 'disk_detach']
 
     ############# classmethods #############
     @classmethod
@@ -309,8 +552,8 @@ class VirtualMachine(DataObject):
         """Get a list of existing VM."""
         res = {}
         with catch_fault():
-            for vmach in api.hosting.vm.list(APIKEY):
-                res[vmach['id']] = VirtualMachine(**vmach)
+            for vmach in cls.iter(api):
+                res[vmach['id']] = vmach
             return res
 
     ########### id only commands ###########
@@ -343,7 +586,7 @@ class VirtualMachine(DataObject):
         info("Deleting VM {}".format(self['id']))
         with catch_fault():
             res = api.hosting.vm.delete(APIKEY, self['id'])
-            ope = Operation(**res)
+            ope = Operation.build(res)
             return ope
 
     def info(self, api):
@@ -351,14 +594,14 @@ class VirtualMachine(DataObject):
         info("Info about VM {}".format(self['id']))
         with catch_fault():
             res = api.hosting.vm.info(APIKEY, self['id'])
-            return VirtualMachine(**res)
+            return VirtualMachine.build(res)
 
     def start(self, api):
         """Start this VM."""
         info("Starting VM {}".format(self['id']))
         with catch_fault():
             res = api.hosting.vm.start(APIKEY, self['id'])
-            ope = Operation(**res)
+            ope = Operation.build(res)
             return ope
 
     def stop(self, api):
@@ -366,7 +609,7 @@ class VirtualMachine(DataObject):
         info("Stopping VM {}".format(self['id']))
         with catch_fault():
             res = api.hosting.vm.stop(APIKEY, self['id'])
-            ope = Operation(**res)
+            ope = Operation.build(res)
             return ope
 
     def reboot(self, api):
@@ -374,7 +617,7 @@ class VirtualMachine(DataObject):
         info("Rebooting VM {}".format(self['id']))
         with catch_fault():
             res = api.hosting.vm.reboot(APIKEY, self['id'])
-            ope = Operation(**res)
+            ope = Operation.build(res)
             return ope
 
     ########### Attach/Detach ##############
@@ -385,7 +628,7 @@ class VirtualMachine(DataObject):
             disk = Disk(api.hosting.disk.info(APIKEY, int(disk_id)))
             info('Disk({}) found'.format(disk_id))
             res = api.hosting.vm.disk_attach(APIKEY, self['id'], disk['id'])
-            return Operation(**res)
+            return Operation.build(res)
 
     def disk_detach(self, api, disk_id):
         """Detach a disk from this VM."""
@@ -393,12 +636,24 @@ class VirtualMachine(DataObject):
             disk = Disk(api.hosting.disk.info(APIKEY, int(disk_id)))
             info('Disk({}) found'.format(disk_id))
             res = api.hosting.vm.disk_detach(APIKEY, self['id'], disk['id'])
-            return Operation(**res)
+            return Operation.build(res)
 
     ############## VM makers ###############
     @classmethod
-    def create(cls, api):
-        """Create a new VM. We use user input to know his configuration."""
+    def create(cls, api, *args, store=None):
+        """
+        Create a new VM. We use user input to know his configuration, and
+        '--image <query>' to select the image without questions.
+        """
+        try:
+            query = pop_option(list(args), '--image', str) or ''
+        except ValueError as exc:
+            warning("Bad input : {}".format(exc))
+            return
+        if store is not None:
+            images = store.index(Image)
+        else:
+            images = ImageIndex(Image.list(api))
         print_iter(Datacenter.list(api))
         datacenter_id = ask_int('datacenter id', 1)
         disk_spec = {'datacenter_id': datacenter_id,
@@ -414,8 +669,17 @@ class VirtualMachine(DataObject):
                        'Please provide a password (not echoed)')}
         while len(vm_spec['password']) < 8:
             vm_spec['password'] = getpass('Password minimum length is 8')
-        image = Image.filter(api, datacenter_id)
+        image = Image.filter(images, datacenter_id, query)
+        if image is None:
+            return
         with catch_fault():
-            ope = api.hosting.vm.create_from(APIKEY, vm_spec,
+            res = api.hosting.vm.create_from(APIKEY, vm_spec,
                                              disk_spec, image)
-            return ope
+            # The operations creating the disk, the iface and the VM
+            return [Operation.build(ope) for ope in res]
+
+
+# Responses decoded straight into objects, see gandishell.decode
+for _ttype in [Datacenter, Disk, Iface, Image, Ip, Operation, VirtualMachine]:
+    register_type(_ttype)
+register('hosting.account.info', Account)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compact mappings, for the many objects we keep."""
+
+from collections.abc import MutableMapping
+
+# Schemas by keys, shared by all the records having the same keys
+SCHEMAS = {}
+
+
+class Schema(dict):
+    """The keys of records, with the position of their values."""
+
+    def __init__(self, keys):
+        super().__init__((key, i) for i, key in enumerate(keys))
+        self.keys_tuple = keys
+
+    @staticmethod
+    def get_schema(keys):
+        """Get the shared schema of these keys (a tuple)."""
+        schema = SCHEMAS.get(keys)
+        if schema is None:
+            schema = SCHEMAS.setdefault(keys, Schema(keys))
+        return schema
+
+
+def rebuild(cls, keys, values):
+    """Unpickle a record, without calling its __init__."""
+    return cls.from_items(keys, values)
+
+
+class Record(MutableMapping):
+    """
+    A mapping storing its values in a tuple, and its keys in a schema
+    shared with the other records having the same keys. Changing it is
+    slow, reading it is as fast as a dict, and it is far smaller.
+    """
+
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, *args, **kwargs):
+        data = dict(*args, **kwargs)
+        self.replace(tuple(data), tuple(data.values()))
+
+    @classmethod
+    def from_items(cls, keys, values):
+        """Build a record from a tuple of keys and a tuple of values."""
+        record = cls.__new__(cls)
+        record.replace(keys, values)
+        return record
+
+    def replace(self, keys, values):
+        """Replace all the content of the record."""
+        self._schema = Schema.get_schema(keys)
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._schema[key]]
+
+    def get(self, key, default=None):
+        position = self._schema.get(key)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __contains__(self, key):
+        return key in self._schema
+
+    def __iter__(self):
+        return iter(self._schema.keys_tuple)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __setitem__(self, key, value):
+        position = self._schema.get(key)
+        if position is None:
+            self.replace(self._schema.keys_tuple + (key,),
+                         self._values + (value,))
+        else:
+            values = list(self._values)
+            values[position] = value
+            self._values = tuple(values)
+
+    def __delitem__(self, key):
+        position = self._schema[key]
+        keys = self._schema.keys_tuple
+        self.replace(keys[:position] + keys[position + 1:],
+                     self._values[:position] + self._values[position + 1:])
+
+    def __eq__(self, other):
+        # Records of the same keys compare their values only
+        if isinstance(other, Record) and other._schema is self._schema:
+            return self._values == other._values
+        return super().__eq__(other)
+
+    __hash__ = None  # Mutable
+
+    def __reduce__(self):
+        return rebuild, (self.__class__, self._schema.keys_tuple,
+                         self._values)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Keep the stored objects fresh, in background."""
+
+from threading import Event, Thread
+from time import time
+
+from gandishell.diff import Diff
+from gandishell.utils import catch_fault
+
+
+class Refresher(Thread):
+    """
+    Fetch again each loaded type on its own interval, swap in the new
+    objects, and tell the shell what changed.
+    """
+
+    def __init__(self, shell, intervals):
+        super().__init__(daemon=True)
+        self.shell = shell
+        self.intervals = intervals  # Seconds, by type
+        self.due = {ttype: time() + interval
+                    for ttype, interval in intervals.items()}
+        self.stopped = Event()
+
+    def run(self):
+        while True:
+            ttype = min(self.due, key=self.due.get)
+            if self.stopped.wait(max(0, self.due[ttype] - time())):
+                return
+            self.due[ttype] = time() + self.intervals[ttype]
+            # Types never used are loaded when needed, fresh
+            if ttype not in self.shell.stored_objects:
+                continue
+            with catch_fault():
+                self.refresh(ttype)
+
+    def refresh(self, ttype):
+        """Fetch the objects of a type, and tell if they changed."""
+        new = self.shell.fetch(ttype)
+        if new is None:
+            return
+        diff = Diff(dict.get(self.shell.stored_objects, ttype, {}), new)
+        self.shell.update_objects(ttype, new)
+        if diff:
+            self.shell.snapshot.save()
+            self.shell.notify(diff.summary(ttype))
+
+    def stop(self):
+        """Stop refreshing, after the current fetch if any."""
+        self.stopped.set()
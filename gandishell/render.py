@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Write objects as blocks, tables or JSON, in bulk."""
+
+import json
+import sys
+from functools import lru_cache
+
+from termcolor import colored
+
+from gandishell.utils import pop_option
+
+# Colored text is the same everytime, compute it once.
+paint = lru_cache(maxsize=4096)(colored)  # pylint: disable=C0103
+
+MODES = ['--table', '--json', '--jsonl']
+BUFFER_SIZE = 1 << 16
+CELL_WIDTH = 40
+
+
+def to_json(value):
+    """Convert what JSON does not know, like dates, to strings."""
+    return str(value)
+
+
+def cell(value):
+    """Get the text of a value in a table cell."""
+    if value is None:
+        return '-'
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(elem) for elem in value)
+    text = str(value).replace('\n', ' ')
+    if len(text) > CELL_WIDTH:
+        text = text[:CELL_WIDTH - 1] + '…'
+    return text
+
+
+class Renderer(object):
+    """Write objects in one of the modes, with only some fields if given."""
+
+    def __init__(self, mode=None, fields=None, out=None):
+        self.mode = mode
+        self.fields = fields
+        self.out = out
+        self.parts = []
+        self.size = 0
+
+    @classmethod
+    def from_options(cls, tokens):
+        """
+        Get a renderer from the options '--table', '--json', '--jsonl' and
+        '--fields a,b', removed from tokens. Raise ValueError on bad ones.
+        """
+        modes = [mode for mode in MODES if pop_option(tokens, mode)]
+        if len(modes) > 1:
+            raise ValueError("{} can not be used together".format(
+                ' and '.join(modes)))
+        fields = pop_option(tokens, '--fields', str)
+        if fields is not None:
+            fields = [field.strip() for field in fields.split(',')
+                      if field.strip()]
+        return cls(modes[0][2:] if modes else None, fields)
+
+    ############### Buffered output ################
+    def write(self, text):
+        """Add text to the buffer, writing it when it is big enough."""
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer."""
+        out = self.out or sys.stdout
+        out.write(''.join(self.parts))
+        out.flush()
+        self.parts, self.size = [], 0
+
+    ################# Rendering ####################
+    def render(self, objs):
+        """Write the objects of an iterable, or the values of a dict."""
+        if isinstance(objs, dict):
+            objs = objs.values()
+        getattr(self, 'render_' + (self.mode or 'blocks'))(objs)
+        self.flush()
+
+    def project(self, obj):
+        """Get the fields of an object to show, as a dict."""
+        if self.fields is None:
+            return dict(obj)
+        return {field: obj.get(field) for field in self.fields}
+
+    def render_blocks(self, objs):
+        """Write the objects like they print themselves."""
+        for obj in objs:
+            self.write(obj.render(self.fields) + '\n')
+
+    def render_json(self, objs):
+        """Write a JSON array of the objects, one by line."""
+        sep = '[\n'
+        for obj in objs:
+            self.write(sep + json.dumps(self.project(obj), default=to_json))
+            sep = ',\n'
+        self.write('[]\n' if sep == '[\n' else '\n]\n')
+
+    def render_jsonl(self, objs):
+        """Write a JSON object by line."""
+        for obj in objs:
+            self.write(json.dumps(self.project(obj), default=to_json) + '\n')
+
+    def render_table(self, objs):
+        """Write aligned columns, one line by object."""
+        objs = list(objs)
+        if not objs:
+            return
+        fields = self.fields or self.columns(objs)
+        rows = [[cell(obj.get(field)) for field in fields] for obj in objs]
+        widths = [max([len(field)] + [len(row[i]) for row in rows])
+                  for i, field in enumerate(fields)]
+        self.write('  '.join(paint(field.ljust(width), 'grey', None,
+                                   ('bold', 'underline'))
+                             for field, width in zip(fields, widths)) + '\n')
+        # Color codes around the ids, without counting them in widths
+        start, end = paint('{}', 'yellow', None, ('bold',)).split('{}')
+        id_column = fields.index('id') if 'id' in fields else None
+        for row in rows:
+            texts = [text.ljust(width) for text, width in zip(row, widths)]
+            if id_column is not None:
+                texts[id_column] = start + texts[id_column] + end
+            self.write('  '.join(texts).rstrip() + '\n')
+
+    @staticmethod
+    def columns(objs):
+        """Get the fields of the objects, id first, in order of appearance."""
+        fields = ['id']
+        hidden = set(getattr(objs[0], 'hidden_keys', [])) | set(fields)
+        for obj in objs:
+            for key in obj:
+                if key not in hidden:
+                    fields.append(key)
+                    hidden.add(key)
+        return fields
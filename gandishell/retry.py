@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""When to call the endpoint, how long, and how many times."""
+
+import asyncio
+import socket
+from contextlib import contextmanager
+from random import uniform
+from time import time
+from xmlrpc.client import Fault, ProtocolError
+
+from gandishell.breaker import CircuitBreaker
+from gandishell.decode import is_read
+from gandishell.limiter import RateLimiter
+
+# Seconds before the first retry, doubled for the next ones up to the cap
+RETRY_BASE = 0.5
+RETRY_CAP = 8
+
+
+def unhealthy(exc):
+    """Tell if an error shows the endpoint unhealthy, worth a retry."""
+    if isinstance(exc, ProtocolError):
+        return exc.errcode >= 500 or exc.errcode == 429
+    return True
+
+
+def retry_delay(attempt):
+    """Get the seconds to wait after a failed attempt, jittered."""
+    return min(RETRY_CAP, RETRY_BASE * 2 ** attempt) * uniform(0.5, 1)
+
+
+class RetryPolicy(object):  # pylint: disable=R0903
+    """
+    The policy shared by the calls of a transport: each one waits for its
+    turn in a RateLimiter, fails at once while a CircuitBreaker is open,
+    must be over before a deadline, and is retried if it only reads.
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, deadline=None, retries=0, breaker=None,
+                 limiter=None, stats=None):
+        self.deadline = deadline  # Seconds for a whole call, if limited
+        self.retries = retries  # Of the read calls
+        self.breaker = breaker or CircuitBreaker(threshold=0)
+        self.limiter = limiter or RateLimiter()
+        self.stats = stats  # A Stats recording the retries, if any
+
+    def start(self, method, calls=1):
+        """Start a call of the method, a multicall of calls if so."""
+        return Call(self, method, calls)
+
+
+class Call(object):
+    """
+    The attempts of a call. Each one waits the seconds given by queue(),
+    then runs in attempt(), until it succeeds or fails for good. Read
+    calls are retried after delay seconds.
+    """
+
+    def __init__(self, policy, method, calls=1):
+        self.policy = policy
+        self.method = method
+        self.calls = calls
+        self.tries = 0
+        self.queued = 0  # Seconds the attempt waits for the rate limit
+        self.delay = 0  # Seconds to wait after a failed attempt
+        self.deadline = None  # time() at which the call must be over
+
+    def queue(self):
+        """Take the tokens of an attempt, and get the seconds to wait."""
+        self.queued = self.policy.limiter.delay(self.method, self.calls)
+        return self.queued
+
+    def time_left(self):
+        """Get the seconds left before the deadline, None without one."""
+        if self.deadline is None:
+            return None
+        left = self.deadline - time()
+        if left <= 0:
+            raise socket.timeout('deadline exceeded')
+        return left
+
+    @contextmanager
+    def attempt(self):
+        """
+        Run an attempt, once its turn came, or raise CircuitOpen. An error
+        worth a retry is suppressed, the next attempt being due in delay
+        seconds.
+        """
+        if self.policy.deadline is not None:
+            # Waiting for the rate limit is not the endpoint's fault
+            if self.deadline is None:
+                self.deadline = time() + self.policy.deadline
+            else:
+                self.deadline += self.queued
+        breaker = self.policy.breaker
+        breaker.before()
+        self.tries += 1
+        try:
+            yield
+        except Fault:
+            breaker.success()
+            raise
+        except (OSError, ProtocolError, asyncio.TimeoutError) as exc:
+            if not unhealthy(exc):
+                breaker.success()
+                raise
+            breaker.failure()
+            self.delay = retry_delay(self.tries - 1)
+            retries = self.policy.retries if is_read(self.method) else 0
+            if self.tries > retries or (
+                    self.deadline is not None and
+                    time() + self.delay >= self.deadline):
+                raise
+            if self.policy.stats is not None:
+                self.policy.stats.record_retry(self.method)
+        except BaseException:
+            breaker.cancel()
+            raise
+        else:
+            breaker.success()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Run commands from the command line, a file or stdin, without prompt."""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+from shlex import split
+from threading import local
+
+from gandishell.shell import STORED_TYPES
+from gandishell.utils import problems, warning
+
+# Actions which only read, and can run along other ones.
+CONCURRENT_TOKEN = ['count', 'info', 'list']
+
+
+def read_lines(text):
+    """Get the commands of a script, without blank lines and comments."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            lines.append(line)
+    return lines
+
+
+def tokenize(line):
+    """Split a line in tokens, or get nothing if it is badly quoted."""
+    try:
+        return split(line)
+    except ValueError:
+        return []
+
+
+def referenced_types(lines):
+    """Get the stored types the instance actions of the lines work on."""
+    ttypes = []
+    for line in lines:
+        tokens = tokenize(line)
+        ttype = STORED_TYPES.get(tokens[0]) if tokens else None
+        if ttype is None or ttype in ttypes or len(tokens) < 2:
+            continue
+        if tokens[1] in ttype.instance_token:
+            ttypes.append(ttype)
+    return ttypes
+
+
+def is_concurrent(line):
+    """Tell if the line only reads, so it can run along other ones."""
+    tokens = tokenize(line)
+    return len(tokens) > 1 and tokens[1] in CONCURRENT_TOKEN
+
+
+def groups(lines, jobs):
+    """
+    Split the lines in groups to run together: consecutive read-only lines
+    when there are many jobs, and every other line alone, so it sees what
+    the previous ones did.
+    """
+    group = []
+    for line in lines:
+        if jobs > 1 and is_concurrent(line):
+            group.append(line)
+            continue
+        if group:
+            yield group
+            group = []
+        yield [line]
+    if group:
+        yield group
+
+
+class ThreadOutput(object):
+    """
+    A stream writing to a buffer of the current thread when it has one, so
+    the outputs of concurrent commands do not mix.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = local()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, text):
+        """Write text in the buffer of the thread, or in the stream."""
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        """Flush the stream, buffers are written at the end."""
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    @contextmanager
+    def capture(self):
+        """Write in a new buffer of the current thread, and yield it."""
+        self.local.buffer = StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            del self.local.buffer
+
+
+def run_line(shell, line):
+    """Run one command of the script."""
+    try:
+        shell.onecmd(line)
+    except ValueError as exc:
+        warning("Bad input : {}".format(exc))
+
+
+def run_concurrently(shell, lines, jobs):
+    """Run the lines at the same time, and print their output in order."""
+    out, err = ThreadOutput(sys.stdout), ThreadOutput(sys.stderr)
+
+    def run(line):
+        """Run a line, and get what it printed."""
+        with out.capture() as out_buffer, err.capture() as err_buffer:
+            run_line(shell, line)
+        return out_buffer.getvalue(), err_buffer.getvalue()
+    sys.stdout, sys.stderr = out, err
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            outputs = list(pool.map(run, lines))
+    finally:
+        sys.stdout, sys.stderr = out.stream, err.stream
+    for out_text, err_text in outputs:
+        sys.stderr.write(err_text)
+        sys.stdout.write(out_text)
+    sys.stdout.flush()
+
+
+def run_script(shell, lines, jobs=1, keep_going=False):
+    """
+    Run the lines, stopping after the first one printing a warning or an
+    error unless keep_going. Return the exit status: 0, or 1 on failures.
+    """
+    shell.provide_objects(*referenced_types(lines))
+    failed = False
+    for group in groups(lines, jobs):
+        before = problems()
+        if len(group) == 1:
+            run_line(shell, group[0])
+        else:
+            run_concurrently(shell, group, jobs)
+        if problems() > before:
+            failed = True
+            if not keep_going:
+                break
+    shell.snapshot.save()
+    return 1 if failed else 0
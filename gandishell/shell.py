@@ -14,126 +14,665 @@
 """Allow to manage Gandi's VM from a shell."""
 
 
+import sys
 from cmd import Cmd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from shlex import split
+from threading import Thread
+from time import sleep, strftime
+
+try:
+    import readline
+except ImportError:  # Not on every platform
+    readline = None  # pylint: disable=C0103
+
+from gandishell.cache import Snapshot, human_age
+from gandishell.diff import Diff
+from gandishell.filters import Predicate, match, pop_predicates
+from gandishell.index import CompletionIndex
+from gandishell.memo import MemoProxy, MEMO
+from gandishell.render import Renderer
 
 from gandishell.objects import (Account, Datacenter, Disk,
                                 Image, Ip, Iface,
                                 Operation, VirtualMachine as VM)
 
-from gandishell.utils import (get_api, PROMPT,
+from gandishell.refresher import Refresher
+from gandishell.store import ObjectStore
+
+from gandishell.utils import (get_api, get_number,
+                              BREAKER, CONFIG, LIMITER, PROMPT, STATS,
+                              WORKERS, WATCH_INTERVAL, WATCH_MAX_INTERVAL,
                               debug, info, warning, welcome,
-                              print_iter, catch_fault
+                              print_iter, catch_fault, pop_option
                               )
 
 
+# Types kept in GandiShell.stored_objects, by command name.
+STORED_TYPES = OrderedDict([('disk', Disk), ('image', Image), ('ip', Ip),
+                            ('iface', Iface), ('operation', Operation),
+                            ('vm', VM)])
+# Actions which do not change anything.
+READ_ONLY_TOKEN = ['connect', 'count', 'info', 'list']
+# Objects named by an Operation, as key and type.
+RELATED_TYPES = [('disk_id', Disk), ('iface_id', Iface), ('ip_id', Ip),
+                 ('vm_id', VM)]
+
+
+def refresh_intervals():
+    """Get the seconds between background refreshes, by type."""
+    intervals = {}
+    for ttype in STORED_TYPES.values():
+        interval = get_number(ttype.__name__, 0, 'REFRESH', float)
+        if interval > 0:
+            intervals[ttype] = interval
+    return intervals
+
+
+def prefetched_types():
+    """Get the types listed in the PREFETCH option."""
+    ttypes = []
+    for name in CONFIG.get('MAIN', 'PREFETCH', fallback='').split(','):
+        name = name.strip()
+        if name in STORED_TYPES:
+            ttypes.append(STORED_TYPES[name])
+        elif name:
+            warning("Unknow type to prefetch : {}.".format(name))
+    return ttypes
+
+
 #pylint: disable=R0904,R0902
 class GandiShell(Cmd):
     """
     The GandiShell is a line-oriented command interpreter that let you
     manage your Gandi hosted virtual machines.
     """
-    api = get_api()
+    api = MemoProxy(get_api(), MEMO)
     prompt = PROMPT
 
-    def __init__(self):
+    def __init__(self, interactive=True):
         with catch_fault():
             super().__init__()
-            self.account = Account(self.api)
-            welcome(self.account)
-            # Map this type of objects to a self variable
-            self.disks, self.images, self.ips = None, None, None
-            self.ifaces, self.operations, self.vms = None, None, None
-            self.stored_objects = {
-                Disk: self.disks,
-                Image: self.images,
-                Ip: self.ips,
-                Iface: self.ifaces,
-                Operation: self.operations,
-                VM: self.vms,
-            }
-            for i in [Disk, Image, Ip, Iface, Operation, VM]:
-                self.stored_objects[i] = i.list(self.api)
-                info("{} loaded.".format(i.__name__))
+            # Scripts get no welcome, and only the types they use.
+            self.interactive = interactive
+            self.account = None
+            # Other types are provided the first time they are needed.
+            self.stored_objects = ObjectStore(self.provide_objects)
+            self.snapshot = Snapshot()
+            self.snapshot.load()
+            self.busy = False  # Running a command, not prompting
+            self.refresher = None
+            if interactive:
+                self.provide_objects(Account, *prefetched_types())
+                intervals = refresh_intervals()
+                if intervals:
+                    self.refresher = Refresher(self, intervals)
+                    self.refresher.start()
+
+    def preloop(self):
+        """Complete whole words, like hostnames with dashes or IPs."""
+        if readline is not None:
+            readline.set_completer_delims(' \t\n')
+
+    def precmd(self, line):
+        """Tell notices not to draw the prompt while a command runs."""
+        self.busy = True
+        return line
+
+    def postcmd(self, stop, line):
+        """Prompting again."""
+        self.busy = False
+        return stop
+
+    def notify(self, text):
+        """Print a notice from the background, then the line being typed."""
+        sys.stderr.write('\r\033[K')
+        info(text)
+        if not self.busy and readline is not None:
+            sys.stdout.write(self.prompt + readline.get_line_buffer())
+            sys.stdout.flush()
+
+    def provide_objects(self, *ttypes):
+        """
+        Make the given types available: use the snapshot right away, fetch
+        what is missing, and refresh what is stale in background. Scripts
+        do not act on stale data, they wait for it to be fetched.
+        """
+        missing, stale = [], []
+        for ttype in ttypes:
+            data = self.snapshot.get(ttype)
+            if data is None:
+                missing.append(ttype)
+                continue
+            self.update_objects(ttype, data, save=False)
+            if ttype is Account and self.interactive:
+                welcome(self.account)
+            if self.snapshot.is_stale(ttype):
+                (stale if self.interactive else missing).append(ttype)
+        if missing:
+            self.load_objects(missing, quiet=not self.interactive)
+        if stale:
+            Thread(target=self.load_objects, args=(stale, True),
+                   daemon=True).start()
+
+    @staticmethod
+    def fetch(ttype):
+        """Get fresh data of the given type, with its own ServerProxy."""
+        api = get_api()
+        if ttype is Account:
+            return Account(api)
+        return ttype.list(api)
+
+    def update_objects(self, ttype, data, save=True):
+        """Swap in new data of the given type."""
+        if data is None:  # The fetch failed, keep what we have.
+            return
+        if ttype is Account:
+            self.account = data
+        else:
+            self.stored_objects[ttype] = data
+        if save:
+            self.snapshot.put(ttype, data)
+
+    def load_objects(self, ttypes, quiet=False):
+        """Fetch the given types concurrently, and save the snapshot."""
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            futures = {pool.submit(self.fetch, ttype): ttype
+                       for ttype in ttypes}
+            for future in as_completed(futures):
+                ttype = futures[future]
+                with catch_fault():
+                    self.update_objects(ttype, future.result())
+                    if quiet:
+                        continue
+                    if ttype is Account:
+                        welcome(self.account)
+                    else:
+                        info("{} loaded.".format(ttype.__name__))
+        self.snapshot.save()
 
     def command_handler(self, line, ttype):
         """Parse the line and run the selected method on the given type."""
         tokens = split(line)
+        options = self.command_options(tokens)
+        if options is None:
+            return
+        wait, batch_size, where, renderer = options
         # No arguments : print out available actions
         if len(tokens) is 0:
             info("Possible actions are : {}".format(' '.join(ttype.all_token)))
             return
         # Class action : execute it
         if tokens[0] in ttype.class_token:
-            res = getattr(ttype, tokens[0])(self.api)
-            print_iter(res)
-        # Instance action : we need an id
-        elif tokens[0] in ttype.instance_token:
-            try:
-                obj_id = int(tokens[1])
-            except ValueError:
-                warning("Bad input.")
-                return
-            except IndexError:
-                warning("'{}' is not a complete command".format(tokens))
-                return
-            try:
-                obj = self.stored_objects[ttype][obj_id]
-            except KeyError as exc:
-                warning("Unknow id: {}".format(exc))
+            # Lists are printed while they are downloaded
+            if tokens[0] == 'list':
+                self.list_objects(ttype, tokens[1:], where, renderer)
                 return
+            done = self.class_action(ttype, tokens, renderer)
+        # Instance action : we need ids, or predicates
+        elif tokens[0] in ttype.instance_token:
+            done = self.instance_action(ttype, tokens, where, renderer,
+                                        batch_size)
+        else:
+            warning("Unknow command : {}.".format(tokens[0]))
+            return
+        # Refresh internal data, except for read-only commands.
+        if done is not None and tokens[0] not in READ_ONLY_TOKEN:
+            objs, results = done
+            # Rolling batches already waited for their operations
+            if wait and not batch_size:
+                results = self.wait_operations(results, renderer)
+            self.refresh_objects(ttype, objs, results)
+
+    @staticmethod
+    def command_options(tokens):
+        """
+        Remove the options from the tokens of a command, and get '--wait',
+        '--batch-size', the predicates after '--where' and a Renderer for
+        '--fields', or None, warning about bad input.
+        """
+        try:
+            wait = pop_option(tokens, '--wait')
+            batch_size = pop_option(tokens, '--batch-size', int)
+            if batch_size is not None and batch_size < 1:
+                raise ValueError("--batch-size must be at least 1")
+            where = pop_predicates(tokens)
+            renderer = Renderer.from_options(tokens)
+        except ValueError as exc:
+            warning("Bad input : {}".format(exc))
+            return None
+        return wait, batch_size, where, renderer
+
+    def class_action(self, ttype, tokens, renderer):
+        """
+        Run a class action, like 'create', and print its results. Get no
+        objects and the results, or None for bad arguments.
+        """
+        kwargs = {}
+        if tokens[0] in ttype.store_token:
+            kwargs['store'] = self.stored_objects
+        try:
+            res = getattr(ttype, tokens[0])(self.api, *tokens[1:], **kwargs)
+        except TypeError as exc:
+            warning("Bad arguments : {}".format(exc))
+            return None
+        results = res if isinstance(res, list) else [res]
+        opes = [ope for ope in results if isinstance(ope, Operation)]
+        if opes:
+            renderer.render(opes)
+        elif res is not None:
+            print_iter(res)
+        return [], results
+
+    # pylint: disable=R0913
+    def instance_action(self, ttype, tokens, where, renderer, batch_size):
+        """
+        Run an instance action on the objects selected by ids, names or
+        predicates. Get these objects and the results, or None if there
+        are none.
+        """
+        if len(tokens) < 2 and where is None:
+            warning("'{}' is not a complete command".format(tokens))
+            return None
+        # Some actions take arguments after a single id
+        if tokens[0] in ttype.single_token:
+            objs = self.select_objects(ttype, tokens[1:2])
+            args = tokens[2:]
+        else:
+            objs = self.select_objects(ttype, tokens[1:], where)
+            args = []
+        if not objs:
+            return None
+        if len(objs) > 1 and tokens[0] in ttype.batch_token:
+            res = getattr(ttype, 'batch_' + tokens[0])(self.api, objs)
+            if res is None:
+                return objs, []
+            renderer.render(res)
+            return objs, list(res.values())
+        return objs, self.fan_out(tokens[0], objs, args, renderer,
+                                  batch_size)
+
+    def wait_operations(self, results, renderer=None):
+        """
+        Wait for the operations among results, and print them with the
+        renderer if given. Get the results with the operations updated.
+        """
+        opes = [res for res in results if isinstance(res, Operation)]
+        if not opes:
+            return results
+        waited = Operation.batch_wait(self.api, opes)
+        if renderer is not None:
+            renderer.render(list(waited.values()))
+        return [waited.get(res['id'], res) if isinstance(res, Operation)
+                else res for res in results]
+
+    def list_objects(self, ttype, tokens, where, renderer):
+        """Print the objects satisfying predicates, like 'state=running'."""
+        predicates = where or []
+        try:
+            sort = pop_option(tokens, '--sort', str)
+            for token in tokens:
+                predicate = Predicate.parse(token)
+                if predicate is None:
+                    warning("Bad input : {}".format(token))
+                    return
+                predicates.append(predicate)
+        except ValueError as exc:  # Like a bad regex
+            warning("Bad input : {}".format(exc))
+            return
+        with catch_fault():
+            renderer.render(ttype.search(self.api, predicates, sort))
+
+    # pylint: disable=R0913
+    def fan_out(self, token, objs, args, renderer, batch_size=None):
+        """
+        Run an instance action on many objects concurrently. With a
+        batch_size, run it by rolling batches, waiting for the operations
+        of each batch before the next one. Return the results.
+        """
+        def run(obj):
+            """Run the action on one object."""
             try:
-                ope = getattr(obj, tokens[0])(self.api, *tokens[2:])
-                print(ope)
+                return getattr(obj, token)(self.api, *args)
             except TypeError as exc:
                 warning("Bad arguments : {}".format(exc))
-            # Refresh internal data, except for read-only commands.
-            if ttype in self.stored_objects \
-                    and tokens[0] not in ['count', 'info', 'list']:
-                debug('refreshing {}'.format(ttype.__name__))
-                self.stored_objects[ttype] = ttype.list(self.api)
-        else:
-            warning("Unknow command : {}.".format(tokens[0]))
+        results, failed = [], []
+        size = batch_size or len(objs)
+        # A single action runs in this thread, to ask questions, run ssh,
+        # or be stopped by Ctrl-C
+        alone = len(objs) == 1 or token in type(objs[0]).single_token
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            for start in range(0, len(objs), size):
+                batch = objs[start:start + size]
+                if alone:
+                    batch_results = [run(obj) for obj in batch]
+                else:
+                    batch_results = list(pool.map(run, batch))
+                renderer.render([res for res in batch_results
+                                 if res is not None])
+                if batch_size:
+                    batch_results = self.wait_operations(batch_results)
+                failed += [obj['id'] for obj, res in zip(batch, batch_results)
+                           if res is None or (isinstance(res, Operation) and
+                                              batch_size and
+                                              res['step'] != 'DONE')]
+                results += batch_results
+                if failed and start + size < len(objs):
+                    warning("Stopping the rolling batches after failures.")
+                    break
+        if len(objs) > 1:
+            info("{}: {} succeeded, {} failed.".format(
+                token, len(results) - len(failed), len(failed)))
+        if failed:
+            warning("Failed on {} {}".format(
+                type(objs[0]).__name__, ', '.join(str(i) for i in failed)))
+        return results
+
+    def refresh_objects(self, ttype, objs, results):
+        """
+        Fetch again the objects touched by a command, and the ones named
+        by the operations it returned, and record these operations.
+        """
+        touched = {ttype: set(obj['id'] for obj in objs)}
+        for ope in results:
+            if not isinstance(ope, Operation):
+                continue
+            self.stored_objects.put(ope)
+            for key, related in RELATED_TYPES:
+                if ope.get(key) is not None:
+                    touched.setdefault(related, set()).add(ope[key])
+        self.save_changes(Operation)
+        for rtype, ids in touched.items():
+            # Types not loaded yet will be fresh when needed
+            if not ids or rtype not in self.stored_objects:
+                continue
+            debug('refreshing {} {}'.format(
+                rtype.__name__, ', '.join(str(i) for i in sorted(ids))))
+            with catch_fault():
+                res, faults = rtype.fetch(self.api, sorted(ids))
+                for obj in res.values():
+                    self.stored_objects.put(obj)
+                # They can not be fetched anymore, like deleted ones.
+                for obj_id in faults:
+                    self.stored_objects.discard(rtype, obj_id)
+            self.save_changes(rtype)
+        self.snapshot.save()
+
+    def save_changes(self, ttype):
+        """Put the stored objects of a type, changed here, in the snapshot."""
+        objs = dict.get(self.stored_objects, ttype)
+        if objs is not None:
+            self.snapshot.update(ttype, objs)
+
+    def token_ids(self, ttype, token):
+        """
+        Get the ids written in a token: an id, a range of the stored ids
+        like '20-30', or a name found in the FieldIndex.
+        """
+        try:
+            if '-' in token[1:]:
+                first, last = [int(i) for i in token.split('-', 1)]
+                return [i for i in sorted(self.stored_objects[ttype])
+                        if first <= i <= last]
+            return [int(token)]
+        except ValueError:
+            return sorted(self.stored_objects.field_index(ttype).resolve(
+                token))
+
+    def fetch_unknown(self, ttype, tokens):
+        """
+        Fetch the objects named by tokens but not stored, which may have
+        been created since they were listed: by id if only ids are
+        missing, or the whole list for names.
+        """
+        stored = self.stored_objects[ttype]
+        missing = []
+        for token in tokens:
+            ids = self.token_ids(ttype, token)
+            if not ids:  # An unknown name
+                self.load_objects([ttype], quiet=True)
+                return
+            missing += [obj_id for obj_id in ids if obj_id not in stored]
+        if not missing:
+            return
+        debug('fetching {} {}'.format(
+            ttype.__name__, ', '.join(str(i) for i in missing)))
+        with catch_fault():
+            res, _ = ttype.fetch(self.api, missing)
+            for obj in res.values():
+                self.stored_objects.put(obj)
+            if res:
+                self.save_changes(ttype)
+                self.snapshot.save()
+
+    def select_objects(self, ttype, tokens, where=None):
+        """
+        Get the stored objects of the given ids, ranges of ids like
+        '20-30', or names like 'web-03', satisfying the predicates if any.
+        Warn about unknown ids and names.
+        """
+        stored = self.stored_objects[ttype]
+        if where is not None:
+            if tokens:
+                objs = self.select_objects(ttype, tokens)
+            elif where:
+                objs = [stored[obj_id] for obj_id in
+                        sorted(self.indexed_ids(ttype, where))]
+            else:  # Never all of them, for want of predicates
+                objs = []
+            return [obj for obj in objs if match(obj, where)]
+        self.fetch_unknown(ttype, tokens)
+        stored = self.stored_objects[ttype]
+        objs = OrderedDict()
+        for token in tokens:
+            ids = self.token_ids(ttype, token)
+            if not ids:
+                warning("Unknow id or name: {}".format(token))
+            for obj_id in ids:
+                try:
+                    objs[obj_id] = stored[obj_id]
+                except KeyError as exc:
+                    warning("Unknow id: {}".format(exc))
+        return list(objs.values())
+
+    def indexed_ids(self, ttype, where):
+        """
+        Get the ids of the objects which may satisfy the predicates: all
+        of them, or the ones found in the FieldIndex for the predicates
+        like 'step=WAIT' on its fields.
+        """
+        ids = None
+        index = self.stored_objects.field_index(ttype)
+        for predicate in where:
+            if predicate.sign == '=' and predicate.key in ttype.lookup_keys:
+                found = index.find(predicate.key, predicate.value)
+                ids = found if ids is None else ids & found
+        if ids is None:
+            return set(self.stored_objects[ttype])
+        return ids
 
     # pylint: disable=W0613,R0913
     def complete_handler(self, text, line, begidx, endidx, ttype):
-        """Propose coherent completions for a given type."""
-        completions = []
-        tokens = split(line)
-        # Empty line: propose all token
-        if len(tokens) == 1:
-            completions = ttype.all_token[:]
-        # There is a first token
-        elif len(tokens) == 2:
-            token = tokens[1]
-            # Is it a complete token that need an id ?
-            if token in ttype.instance_token:
-                completions = [str(key) + ' ' for key in
-                               self.stored_objects[ttype].keys()]
-            # Or do we need to complete ? (can implicitely be empty)
-            elif token not in ttype.all_token:
-                completions = [f + ' ' for f in ttype.all_token
-                               if f.startswith(token)]
-            # Implicit else: the token is already complete
-        # Complete ids when they are ambiguous
-        elif len(tokens) == 3:
-            token = tokens[2]
-            # double str(key) is not very clean, but works
-            completions = [str(key) + ' ' for key in
-                           self.stored_objects[ttype].keys()
-                           if str(key).startswith(token)]
-        return completions
+        """
+        Propose coherent completions for a given type: actions, then ids
+        and names of objects, through a prefix index.
+        """
+        before = line[:begidx].split()
+        # Action
+        if len(before) == 1:
+            return [token + ' ' for token in ttype.all_token
+                    if token.startswith(text)]
+        # Ids, or names standing for their id, after an instance action
+        if before[1] not in ttype.instance_token or text.startswith('-'):
+            return []
+        if before[1] in ttype.single_token and len(before) > 2:
+            return []
+        return self.stored_objects.index(ttype, CompletionIndex).complete(
+            text)
 
     ############### Small commands without arguments ################
     def do_account_info(self, line):
         """account_info [refresh] : Show acount data."""
-        if line:
+        if self.account is None:
+            self.provide_objects(Account)
+            if self.account is None:
+                return
+        elif line:
             debug('Refreshing account info')
+            MEMO.forget(['hosting.account'])
             self.account.refresh(self.api)
+            self.snapshot.put(Account, self.account)
         print(self.account)
 
-    def do_EOF(self, line):  # pylint: disable=C0103,W0613,R0201
+    def do_cache(self, line):
+        """cache [purge] : Show the age of cached data, or forget it."""
+        if line.strip() == 'purge':
+            self.snapshot.purge()
+            MEMO.forget()
+            info('Cache purged.')
+            return
+        elif line.strip():
+            warning("Unknow command : {}.".format(line.strip()))
+            return
+        info("Cache file: {}".format(self.snapshot.path))
+        for ttype in [Account] + list(STORED_TYPES.values()):
+            age = self.snapshot.age(ttype)
+            ttl = human_age(self.snapshot.ttl(ttype))
+            if age is None:
+                print("{:>16}: not cached".format(ttype.__name__))
+            else:
+                print("{:>16}: {} old (ttl {}){}".format(
+                    ttype.__name__, human_age(age), ttl,
+                    ' stale' if age > self.snapshot.ttl(ttype) else ''))
+
+    # pylint: disable=W0613
+    def complete_cache(self, text, line, begidx, endidx):
+        """Autocompletion for the cache command."""
+        return ['purge'] if 'purge'.startswith(text) else []
+
+    def default(self, line):
+        """Warn about unknown commands."""
+        warning("Unknow command : {}.".format(line.split()[0]))
+
+    def do_stats(self, line):
+        """
+        stats [reset|method] : Show the API calls by method and the hits
+        of the remembered ones, the latency histogram of a method, or
+        forget them.
+        """
+        line = line.strip()
+        if line == 'reset':
+            STATS.reset()
+            MEMO.reset()
+            info('Stats reset.')
+            return
+        elif line:
+            lines = STATS.histogram_lines(line)
+            if lines:
+                print('\n'.join(lines))
+            else:
+                warning("No call of {}.".format(line))
+            return
+        print('\n'.join(STATS.lines()))
+        for kind, count in sorted(STATS.shown.items()):
+            print("{} shown {} times".format(kind, count))
+        lines = MEMO.lines()
+        if lines:
+            print('\n'.join(lines))
+        print(BREAKER.describe())
+        print(LIMITER.describe())
+
+    # pylint: disable=W0613
+    def complete_stats(self, text, line, begidx, endidx):
+        """Autocompletion for the stats command."""
+        return [word for word in ['reset'] + sorted(STATS.methods)
+                if word.startswith(text)]
+
+    def do_watch(self, line):
+        """
+        watch type [predicates] [--interval seconds] [--polls count] :
+        Poll the objects of a type and print only what changed, less and
+        less often while nothing changes, until Ctrl-C.
+        """
+        options = self.watch_options(line)
+        if options is None:
+            return
+        try:
+            self.watch(*options)
+        except KeyboardInterrupt:
+            print()
+        self.snapshot.save()
+
+    @staticmethod
+    def watch_options(line):
+        """
+        Get the type, predicates, interval and polls of a watch command,
+        or None, warning about bad input.
+        """
+        tokens = split(line)
+        predicates = []
+        try:
+            interval = pop_option(tokens, '--interval', float) \
+                or WATCH_INTERVAL
+            polls = pop_option(tokens, '--polls', int)
+            for token in tokens[1:]:
+                predicate = Predicate.parse(token)
+                if predicate is None:
+                    warning("Bad input : {}".format(token))
+                    return None
+                predicates.append(predicate)
+        except ValueError as exc:  # Like a bad regex
+            warning("Bad input : {}".format(exc))
+            return None
+        if not tokens or tokens[0] not in STORED_TYPES:
+            warning("Watch one of : {}".format(' '.join(STORED_TYPES)))
+            return None
+        return STORED_TYPES[tokens[0]], predicates, interval, polls
+
+    def watch(self, ttype, predicates, interval, polls=None):
+        """
+        Poll the objects of a type satisfying the predicates, printing
+        what changed, polls times or until interrupted.
+        """
+        def select(objs):
+            """Keep the objects satisfying the predicates."""
+            return {obj_id: obj for obj_id, obj in objs.items()
+                    if match(obj, predicates)}
+        old = select(self.stored_objects[ttype])
+        info("Watching {} {}, Ctrl-C to stop.".format(len(old),
+                                                      ttype.__name__))
+        delay, done = interval, 0
+        while polls is None or done < polls:
+            if done:
+                sleep(delay)
+            done += 1
+            # Back off while nothing changes, or the API fails
+            delay = min(delay * 2, max(interval, WATCH_MAX_INTERVAL))
+            data = self.fetch(ttype)
+            if data is None:
+                continue
+            self.update_objects(ttype, data)
+            new = select(data)
+            diff = Diff(old, new)
+            if diff:
+                now = strftime('%H:%M:%S')
+                print('\n'.join('{} {}'.format(now, text)
+                                for text in diff.lines(ttype)), flush=True)
+                old, delay = new, interval
+
+    # pylint: disable=W0613
+    def complete_watch(self, text, line, begidx, endidx):
+        """Autocompletion for the watch command."""
+        if len(line[:begidx].split()) > 1:
+            return []
+        return [name + ' ' for name in STORED_TYPES if name.startswith(text)]
+
+    def do_EOF(self, line):  # pylint: disable=C0103
         """Just say good-bye at end."""
+        if self.refresher is not None:
+            self.refresher.stop()
+        self.snapshot.save()
         print("\n*{:-^77}*".format("- See U Soon - .{}".format(line)))
         return True
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Count the API calls, their latency and their size, by method."""
+
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+from time import time
+
+# Upper bounds of the latency buckets, in milliseconds
+BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+
+def bucket_name(bound):
+    """Get the name of a bucket in exports, like '<=250ms'."""
+    if bound == float('inf'):
+        return '>{}ms'.format(BUCKETS[-2])
+    return '<={}ms'.format(bound)
+
+
+# pylint: disable=R0902
+class MethodStats(object):
+    """What we know about the calls of one method."""
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.faults = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.sent = 0
+        self.received = 0
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, seconds, sent, received, fault, error):
+        """Count a call."""
+        self.calls += 1
+        self.faults += fault
+        self.errors += error
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.sent += sent
+        self.received += received
+        millis = seconds * 1000
+        for i, bound in enumerate(BUCKETS):
+            if millis <= bound:
+                self.histogram[i] += 1
+                break
+
+    def percentile(self, rank):
+        """
+        Get the latency under which are rank (0 to 1) of the calls, in
+        seconds, as the upper bound of its bucket.
+        """
+        count, goal = 0, rank * self.calls
+        for bound, calls in zip(BUCKETS, self.histogram):
+            count += calls
+            if count >= goal and calls:
+                return min(bound / 1000, self.max)
+        return self.max
+
+    def to_dict(self):
+        """Get the stats as a dict, to export them."""
+        return {'calls': self.calls, 'retries': self.retries,
+                'faults': self.faults,
+                'errors': self.errors, 'seconds': round(self.seconds, 6),
+                'max_seconds': round(self.max, 6), 'sent_bytes': self.sent,
+                'received_bytes': self.received,
+                'histogram': {bucket_name(bound): calls for bound, calls
+                              in zip(BUCKETS, self.histogram) if calls}}
+
+
+class Stats(object):
+    """The stats of all the methods called, shared by the transports."""
+
+    def __init__(self, breaker=None, limiter=None):
+        self.lock = Lock()
+        self.breaker = breaker  # A CircuitBreaker to report, if any
+        self.limiter = limiter  # A RateLimiter to report, if any
+        self.reset()
+
+    def reset(self):
+        """Forget everything."""
+        with self.lock:
+            self.start = time()
+            self.methods = {}
+            self.shown = Counter()  # Errors shown by catch_fault
+
+    # pylint: disable=R0913
+    def record(self, method, seconds, sent=0, received=0, fault=False,
+               error=False):
+        """
+        Count a call of the method which took seconds, sending and
+        receiving some bytes, and failing with a Fault or another error.
+        """
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.add(seconds, sent, received, fault, error)
+
+    def record_retry(self, method):
+        """Count a call of the method retried after a failure."""
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.retries += 1
+
+    def record_shown(self, kind):
+        """Count an error shown to the user, like 'Fault 510042'."""
+        with self.lock:
+            self.shown[kind] += 1
+
+    def sorted_methods(self):
+        """Get the methods and their stats, the longest ones first."""
+        with self.lock:
+            return sorted(self.methods.items(),
+                          key=lambda item: -item[1].seconds)
+
+    def lines(self):
+        """Get a table of the stats, as lines of text."""
+        lines = ["{:<32} {:>6} {:>5} {:>5} {:>8} {:>8} {:>8} {:>8} {:>9} "
+                 "{:>9}".format('method', 'calls', 'retry', 'fail', 'avg ms',
+                                'p50 ms', 'p95 ms', 'max ms', 'sent KB',
+                                'recv KB')]
+        for method, stats in self.sorted_methods():
+            lines.append(
+                "{:<32} {:>6} {:>5} {:>5} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} "
+                "{:>9.1f} {:>9.1f}".format(
+                    method[:32], stats.calls, stats.retries,
+                    stats.faults + stats.errors,
+                    stats.seconds / max(stats.calls, 1) * 1000,
+                    stats.percentile(0.5) * 1000,
+                    stats.percentile(0.95) * 1000, stats.max * 1000,
+                    stats.sent / 1024, stats.received / 1024))
+        return lines
+
+    def histogram_lines(self, method, width=40):
+        """Get the latency histogram of a method, as lines of text."""
+        stats = self.methods.get(method)
+        if stats is None:
+            return []
+        most = max(stats.histogram)
+        # From the first bucket used to the last one
+        used = [i for i, calls in enumerate(stats.histogram) if calls]
+        return ["{:>9} {:>6} {}".format(bucket_name(bound), calls,
+                                        '#' * (width * calls // most))
+                for bound, calls in list(zip(BUCKETS, stats.histogram))[
+                    used[0]:used[-1] + 1]]
+
+    def to_dict(self):
+        """Get all the stats as a dict, to export them."""
+        with self.lock:
+            methods = {method: stats.to_dict()
+                       for method, stats in self.methods.items()}
+            shown = dict(self.shown)
+        res = {'start': datetime.fromtimestamp(self.start).isoformat(),
+               'seconds': round(time() - self.start, 3),
+               'methods': methods, 'errors_shown': shown}
+        if self.breaker is not None:
+            res['circuit'] = self.breaker.to_dict()
+        if self.limiter is not None:
+            res['rate'] = self.limiter.to_dict()
+        return res
+
+    def export(self, path):
+        """Write the stats in a JSON file."""
+        path = os.path.expanduser(path)
+        with open(path, 'w') as out:
+            json.dump(self.to_dict(), out, indent=2, sort_keys=True)
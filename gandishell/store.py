@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Registry of the objects known by the shell, by type."""
+
+from threading import Lock
+
+from gandishell.index import FieldIndex
+
+
+class ObjectStore(dict):
+    """
+    Map a type to a dict of its objects by id. A type is loaded the first
+    time it is needed, then kept. The dicts are never changed, but
+    replaced, so other threads can iterate them safely. Indexes are built
+    again after changes, field indexes are updated.
+    """
+
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+        self.lock = Lock()
+        self.indexes = {}
+        self.field_indexes = {}
+
+    def __setitem__(self, ttype, objs):
+        old_objs = dict.get(self, ttype, {})
+        super().__setitem__(ttype, objs)
+        self.indexes.pop(ttype, None)
+        if ttype in self.field_indexes:
+            self.field_indexes[ttype].update(old_objs, objs)
+
+    def __missing__(self, ttype):
+        with self.lock:
+            # Another thread may have loaded it while we were waiting.
+            if not dict.__contains__(self, ttype):
+                self.loader(ttype)
+        # Do not memoize a failed load, it will be tried again next time.
+        return dict.get(self, ttype, {})
+
+    def put(self, obj):
+        """Add or replace an object, if its type is loaded."""
+        objs = dict.get(self, type(obj))
+        if objs is not None:
+            old = objs.get(obj['id'])
+            # A new dict: other threads may be iterating the current one
+            objs = dict(objs)
+            objs[obj['id']] = obj
+            dict.__setitem__(self, type(obj), objs)
+            self.indexes.pop(type(obj), None)
+            if type(obj) in self.field_indexes:
+                self.field_indexes[type(obj)].replace(old, obj)
+
+    def discard(self, ttype, obj_id):
+        """Remove an object, if its type is loaded."""
+        objs = dict.get(self, ttype)
+        if objs is not None and obj_id in objs:
+            objs = dict(objs)
+            old = objs.pop(obj_id)
+            dict.__setitem__(self, ttype, objs)
+            self.indexes.pop(ttype, None)
+            if ttype in self.field_indexes:
+                self.field_indexes[ttype].remove(old)
+
+    def index(self, ttype, index_class=None):
+        """
+        Get an index of the objects of this type, by default the
+        index_class of the type, built once for each refresh of this type.
+        """
+        index_class = index_class or ttype.index_class
+        index = self.indexes.get(ttype, {}).get(index_class)
+        if index is None:
+            objs = self[ttype]
+            index = index_class(objs, ttype)
+            # Not the objects of a failed load, nor replaced meanwhile
+            if dict.get(self, ttype) is objs:
+                self.indexes.setdefault(ttype, {})[index_class] = index
+        return index
+
+    def field_index(self, ttype):
+        """Get the FieldIndex of this type, kept up to date."""
+        index = self.field_indexes.get(ttype)
+        if index is None:
+            index = self.field_indexes[ttype] = FieldIndex(self[ttype], ttype)
+        return index
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""A thread-safe XML-RPC transport, keeping connections alive."""
+
+import http.client
+import socket
+import ssl
+from queue import Empty, Full, LifoQueue
+from threading import BoundedSemaphore, Lock
+from time import sleep, time
+from xmlrpc.client import (Fault, GzipDecodedResponse, ProtocolError,
+                           Transport)
+
+from gandishell.decode import getparser, method_of
+from gandishell.retry import RetryPolicy
+
+# Errors telling that the server closed a kept-alive connection.
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError,
+                ConnectionResetError, ConnectionAbortedError)
+# Bytes of response parsed at once
+READ_SIZE = 1 << 16
+# Counted in a multicall request body, once for each call
+CALL_NAME = b'<name>methodName</name>'
+
+
+class Deadline(object):
+    """
+    Timeouts of a connection: to connect, to read, and a deadline for
+    the whole call.
+    """
+    connect_timeout = None
+    read_timeout = None
+    deadline = None  # time() at which the call must be over, if any
+
+    def time_left(self, timeout):
+        """Get the timeout, shortened by the deadline."""
+        if self.deadline is None:
+            return timeout
+        left = self.deadline - time()
+        if left <= 0:
+            raise socket.timeout('deadline exceeded')
+        return min(timeout, left)
+
+    def limit(self):
+        """Wait for the socket no longer than the deadline."""
+        # timeout and sock belong to http.client.HTTPConnection
+        # pylint: disable=E1101,W0201
+        self.timeout = self.time_left(self.connect_timeout)
+        if self.sock is not None:
+            self.sock.settimeout(self.time_left(self.read_timeout))
+
+
+class HTTPConnection(Deadline, http.client.HTTPConnection):
+    """An HTTP connection with distinct connect and read timeouts."""
+
+    def __init__(self, host, connect_timeout, read_timeout):
+        super().__init__(host, timeout=connect_timeout)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super().connect()
+        self.sock.settimeout(self.time_left(self.read_timeout))
+
+
+class HTTPSConnection(Deadline, http.client.HTTPSConnection):
+    """An HTTPS connection resuming the last TLS session of its host."""
+
+    # pylint: disable=R0913
+    def __init__(self, host, connect_timeout, read_timeout,
+                 context, tls_sessions):
+        super().__init__(host, timeout=connect_timeout, context=context)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tls_sessions = tls_sessions
+
+    def connect(self):
+        # Same as HTTPSConnection.connect, with a session to resume.
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=server_hostname,
+            session=self.tls_sessions.get(server_hostname))
+        self.sock.settimeout(self.time_left(self.read_timeout))
+
+
+# pylint: disable=R0902
+class PooledTransport(Transport):
+    """
+    Send requests over a small pool of persistent HTTP/1.1 connections,
+    which can be shared by many threads. Each call must be over before
+    a deadline, the read ones are retried when the endpoint fails, and
+    a CircuitBreaker stops calling it while it keeps failing. Calls wait
+    for their turn in a RateLimiter. This RetryPolicy is shared with the
+    AsyncTransport.
+    """
+
+    accept_gzip_encoding = True
+
+    # pylint: disable=R0913
+    def __init__(self, scheme='https', pool_size=8,
+                 connect_timeout=10, read_timeout=60, use_datetime=True,
+                 stats=None, deadline=None, retries=0, breaker=None,
+                 limiter=None):
+        super().__init__(use_datetime=use_datetime)
+        self.stats = stats  # A Stats recording the calls, if any
+        self.policy = RetryPolicy(deadline, retries, breaker, limiter, stats)
+        self.scheme = scheme
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.context = ssl.create_default_context()
+        self.tls_sessions = {}
+        self.idle = {}  # Idle connections, by host
+        self.slots = BoundedSemaphore(pool_size)
+        self.lock = Lock()
+        self.verbose = False  # Print the responses, of the last request
+
+    def new_connection(self, host):
+        """Open a new connection to this host."""
+        chost, self._extra_headers, _ = self.get_host_info(host)
+        if self.scheme == 'https':
+            return HTTPSConnection(chost, self.connect_timeout,
+                                   self.read_timeout, self.context,
+                                   self.tls_sessions)
+        return HTTPConnection(chost, self.connect_timeout, self.read_timeout)
+
+    def acquire(self, host):
+        """Get an idle connection to this host, or a new one."""
+        with self.lock:
+            idle = self.idle.setdefault(host, LifoQueue(self.pool_size))
+        try:
+            return idle.get_nowait(), True
+        except Empty:
+            return self.new_connection(host), False
+
+    def release(self, host, conn):
+        """Put back a connection in the pool, keeping its TLS session."""
+        session = getattr(conn.sock, 'session', None)
+        if session is not None:
+            self.tls_sessions[conn.host] = session
+        try:
+            self.idle[host].put_nowait(conn)
+        except (KeyError, Full):  # Closed meanwhile, or enough idle ones
+            conn.close()
+
+    def post(self, conn, handler, request_body, verbose):
+        """Send the request on this connection and get the response."""
+        conn.set_debuglevel(1 if verbose else 0)
+        conn.putrequest('POST', handler, skip_accept_encoding=True)
+        headers = self._headers + self._extra_headers + [
+            ('Accept-Encoding', 'gzip'),
+            ('Content-Type', 'text/xml'),
+            ('User-Agent', self.user_agent)]
+        self.send_headers(conn, headers)
+        self.send_content(conn, request_body)
+        return conn.getresponse()
+
+    def request(self, host, handler, request_body, verbose=False):
+        method = method_of(request_body)
+        calls = request_body.count(CALL_NAME) \
+            if method and method.startswith('system.multicall') else 1
+        call = self.policy.start(method, calls)
+        while True:
+            if call.queue() > 0:
+                sleep(call.queued)
+            with call.attempt():
+                return self.request_once(host, handler, request_body,
+                                         verbose, method, call.deadline)
+            sleep(call.delay)
+
+    # pylint: disable=R0913
+    def request_once(self, host, handler, request_body, verbose, method,
+                     deadline=None):
+        """Send a request, and get its result before the deadline if any."""
+        with self.slots:
+            start, received = time(), 0
+            fault, error = False, True
+            conn, reused = self.acquire(host)
+            conn.deadline = deadline
+            clean = False
+            try:
+                conn.limit()
+                try:
+                    resp = self.post(conn, handler, request_body, verbose)
+                except STALE_ERRORS:
+                    if not reused:
+                        raise
+                    # Kept-alive connection closed by the server: retry once
+                    conn.close()
+                    conn.limit()
+                    resp = self.post(conn, handler, request_body, verbose)
+                received = int(resp.getheader('Content-Length') or 0)
+                if resp.status != 200:
+                    resp.read()
+                    clean = True
+                    raise ProtocolError(host + handler, resp.status,
+                                        resp.reason, dict(resp.getheaders()))
+                self.verbose = verbose
+                result = self.parse_response(resp, method, conn)
+                clean, error = True, False
+                return result
+            except Fault:
+                clean, fault, error = True, True, False
+                raise
+            finally:
+                # Unexpected errors leave the connection in a strange state
+                if not clean:
+                    conn.close()
+                self.release(host, conn)
+                if self.stats is not None:
+                    self.stats.record(method, time() - start,
+                                      len(request_body), received,
+                                      fault, error)
+
+    def getparser(self, method=None):
+        """Get a parser decoding the response of the method."""
+        return getparser(method, self._use_datetime, self._use_builtin_types)
+
+    def parse_response(self, response, method=None, conn=None):
+        """
+        Parse the response while it is read, in large chunks, before the
+        deadline of its connection if given.
+        """
+        if response.getheader('Content-Encoding', '') == 'gzip':
+            stream = GzipDecodedResponse(response)
+        else:
+            stream = response
+        parser, unmarshaller = self.getparser(method)
+        while True:
+            if conn is not None:
+                conn.limit()
+            data = stream.read(READ_SIZE)
+            if not data:
+                break
+            if self.verbose:
+                print("body:", repr(data))
+            parser.feed(data)
+        if stream is not response:
+            stream.close()
+        parser.close()
+        return unmarshaller.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            pools, self.idle = self.idle, {}
+        for idle in pools.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except Empty:
+                    break
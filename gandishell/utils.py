@@ -13,14 +13,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """Various useful fonctions used everywhere."""
 
+import sys
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from contextlib import contextmanager
+from random import uniform
 from socket import error as SocketError
+from threading import Lock
 from types import FunctionType
-from xmlrpc.client import Fault, ServerProxy
+from urllib.parse import urlparse
+from xmlrpc.client import Fault, MultiCall, ProtocolError, ServerProxy
 
 from termcolor import colored
 
+from gandishell.breaker import CircuitBreaker
+from gandishell.limiter import RateLimiter
+from gandishell.stats import Stats
+from gandishell.transport import PooledTransport
+
 CONFIG = ConfigParser()
 CONFIG.read('config.ini')
 
@@ -63,12 +74,98 @@ def ask_int(name, default=0, choices=None):
     return inpt
 
 
+def pop_option(tokens, name, kind=None):
+    """
+    Remove an option, like '--wait' or '--batch-size 10', from tokens.
+    Return None if it is missing, True for a flag, or its value converted
+    with kind. Raise ValueError if the value is missing or bad.
+    """
+    if name not in tokens:
+        return None
+    index = tokens.index(name)
+    if kind is None:
+        del tokens[index]
+        return True
+    try:
+        value = kind(tokens[index + 1])
+    except IndexError:
+        raise ValueError("{} needs a value".format(name))
+    del tokens[index:index + 2]
+    return value
+
+
 def get_api():
-    """Simple accessor to the api."""
+    """
+    Simple accessor to the api. All the proxies share the same pool of
+    connections, so they can be used from any thread.
+    """
     if DEBUG:
-        return ServerProxy(ENDPOINT, use_datetime=True, verbose=True)
+        return ServerProxy(ENDPOINT, transport=TRANSPORT, verbose=True)
     else:
-        return ServerProxy(ENDPOINT, use_datetime=True)
+        return ServerProxy(ENDPOINT, transport=TRANSPORT)
+
+
+def multicall(api, method, calls):
+    """
+    Call the method once for each tuple of params in calls, grouped in
+    batches of system.multicall. Yield the result, or the Fault, of each call.
+    """
+    for start in range(0, len(calls), MULTICALL_SIZE):
+        batch = MultiCall(api)
+        for params in calls[start:start + MULTICALL_SIZE]:
+            getattr(batch, method)(*params)
+        results = batch()
+        for i in range(len(results.results)):
+            try:
+                yield results[i]
+            except Fault as exc:
+                yield exc
+
+
+def iter_pages(api, method, options=None):
+    """
+    Call a list method page by page, and yield the items. The next page is
+    fetched in background while the items of the current one are used.
+    """
+    def fetch(page):
+        """Get the items of a page."""
+        opts = dict(options or {}, items_per_page=PAGE_SIZE, page=page)
+        return getattr(api, method)(APIKEY, opts)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        page, future = 0, pool.submit(fetch, 0)
+        while future is not None:
+            items = future.result()
+            # A full page may not be the last one
+            if len(items) < PAGE_SIZE:
+                future = None
+            else:
+                page += 1
+                future = pool.submit(fetch, page)
+            for item in items:
+                yield item
+
+
+def backoff(base=1, cap=30, factor=2):
+    """
+    Yield growing delays in seconds, with random jitter, to poll or retry
+    without hammering the api.
+    """
+    delay = base
+    while True:
+        yield delay / 2 + uniform(0, delay / 2)
+        delay = min(cap, delay * factor)
+
+
+def progress(text, done=False):
+    """
+    Print text over the current line, to show a live progress on a
+    terminal. Logs and pipes only get the last text, when done.
+    """
+    if sys.stderr.isatty():
+        sys.stderr.write('\r\033[K' + text + ('\n' if done else ''))
+        sys.stderr.flush()
+    elif done and text:
+        print(text, file=sys.stderr)
 
 
 def bold(text):
@@ -76,37 +173,56 @@ def bold(text):
     print(colored(text, attrs=['bold']))
 
 
+# Number of warnings and errors printed, to get the exit status of scripts
+PROBLEMS = {'count': 0}
+PROBLEMS_LOCK = Lock()
+
+
+def problems():
+    """Get the number of warnings and errors printed so far."""
+    return PROBLEMS['count']
+
+
+def count_problem():
+    """Count a warning or an error."""
+    with PROBLEMS_LOCK:
+        PROBLEMS['count'] += 1
+
+
+# Messages go to stderr, so they do not mix with objects in stdout.
 def debug(text):
     """Print text in green, for debugging."""
-    print(colored(text, 'yellow'))
+    print(colored(text, 'yellow'), file=sys.stderr)
 
 
 def info(text):
     """Print text underlined."""
-    print(colored(text, attrs=['underline']))
+    print(colored(text, attrs=['underline']), file=sys.stderr)
 
 
 def error(text):
     """Print text in bold red with exclamation marks, for errors."""
+    count_problem()
     print(colored('/!\\ ' + text + ' /!\\',
-          'yellow', 'on_red', attrs=['bold']))
+          'yellow', 'on_red', attrs=['bold']), file=sys.stderr)
 
 
 def warning(text):
     """Print text in bold red for warning."""
-    print(colored(text, 'red', attrs=['bold']))
+    count_problem()
+    print(colored(text, 'red', attrs=['bold']), file=sys.stderr)
 
 
 def print_iter(toprint):
-    """Print all elements of a list or of a dict."""
-    if isinstance(toprint, list):
+    """Print all elements of a list, of a dict, or of an iterator."""
+    if isinstance(toprint, (list, Iterator)):
         for elem in toprint:
             print(elem)
     elif isinstance(toprint, dict):
         for elem in toprint.values():
             print(elem)
     else:
-        info(toprint)
+        print(colored(toprint, attrs=['underline']))
 
 
 def welcome(account):
@@ -135,15 +251,28 @@ conditions.""".format(VERSION)
 
 @contextmanager
 def catch_fault():
-    """A decorator to catch xmlprc.Fault, and just print it."""
+    """
+    A decorator to catch xmlprc.Fault, and the errors of the endpoint
+    left after the retries, and just print them.
+    """
     try:
         yield
     except Fault as exc:
+        STATS.record_shown('Fault {}'.format(exc.faultCode))
         error("An XMLRPC error {} occured: {}".format(
               exc.faultCode, exc.faultString))
     except SocketError as exc:
-        error("A socket error occured: ({}) - {}".format(
-              exc.errno, exc.strerror))
+        STATS.record_shown(type(exc).__name__)
+        if exc.errno is None:  # Timeouts, open circuit
+            error("A socket error occured: {} - {}".format(
+                  type(exc).__name__, exc))
+        else:
+            error("A socket error occured: ({}) - {}".format(
+                  exc.errno, exc.strerror))
+    except ProtocolError as exc:
+        STATS.record_shown('HTTP {}'.format(exc.errcode))
+        error("An HTTP error occured: {} {}".format(exc.errcode,
+                                                    exc.errmsg))
 
 
 try:
@@ -151,3 +280,45 @@ try:
 except ValueError as exc:
     warning(exc)
     DEBUG = 2
+
+
+def get_number(option, default, section='MAIN', kind=int):
+    """Read a number in the config, or warn and use the default value."""
+    try:
+        return kind(CONFIG.get(section, option, fallback=default))
+    except ValueError as exc:
+        warning(exc)
+        return default
+
+
+def rate_weights():
+    """Get the weights of the methods in the RATE section, like 'x.y=2'."""
+    if not CONFIG.has_section('RATE'):
+        return {}
+    return {method: get_number(method, 1, 'RATE', float)
+            for method in CONFIG['RATE'] if '.' in method}
+
+
+WORKERS = get_number('WORKERS', 8)
+MULTICALL_SIZE = get_number('MULTICALL_SIZE', 50)
+PAGE_SIZE = get_number('PAGE_SIZE', 100)
+WAIT_TIMEOUT = get_number('WAIT_TIMEOUT', 600, kind=float)
+POOL_SIZE = get_number('POOL_SIZE', 8)
+CONNECT_TIMEOUT = get_number('CONNECT_TIMEOUT', 10, kind=float)
+READ_TIMEOUT = get_number('READ_TIMEOUT', 60, kind=float)
+ASYNC_CONNECTIONS = get_number('ASYNC_CONNECTIONS', 64)
+WATCH_INTERVAL = get_number('WATCH_INTERVAL', 5, kind=float)
+WATCH_MAX_INTERVAL = get_number('WATCH_MAX_INTERVAL', 60, kind=float)
+DEADLINE = get_number('DEADLINE', 120, kind=float)
+RETRIES = get_number('RETRIES', 2)
+BREAKER = CircuitBreaker(get_number('BREAKER_THRESHOLD', 5),
+                         get_number('BREAKER_COOLDOWN', 30, kind=float))
+LIMITER = RateLimiter(get_number('RATE', 0, 'RATE', float),
+                      get_number('BURST', 10, 'RATE', float), rate_weights())
+# Stats of the API calls, written in STATS_FILE at exit if set
+STATS = Stats(BREAKER, LIMITER)
+STATS_FILE = CONFIG.get('MAIN', 'STATS_FILE', fallback=None)
+TRANSPORT = PooledTransport(urlparse(ENDPOINT).scheme, POOL_SIZE,
+                            CONNECT_TIMEOUT, READ_TIMEOUT, stats=STATS,
+                            deadline=DEADLINE or None, retries=RETRIES,
+                            breaker=BREAKER, limiter=LIMITER)
@@ -86,6 +86,11 @@ setup(
             # Develop tools
             'check_lint=tests.helpers:run_check_lint',
             'check_pep8=tests.helpers:run_check_pep8',
+            'bench_memory=tests.benchmarks:run_bench_memory',
+            'bench_async=tests.benchmarks:run_bench_async',
+            'bench_decode=tests.benchmarks:run_bench_decode',
+            'bench_scale=tests.bench_scale:run_bench_scale',
+            'fake_gandi=tests.fake_gandi:run_fake_gandi',
         ],
     },
 )
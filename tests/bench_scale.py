@@ -0,0 +1,137 @@
+# coding: utf-8
+"""
+How the shell scales with the size of the fleet: startup, list, info,
+actions, completion and refresh, against the fake API, at 10, 1k and
+10k VMs, compared with a saved baseline.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stderr, redirect_stdout
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from tests.fake_gandi import FakeGandi
+
+SIZES = [10, 1000, 10000]
+CONFIG = """[MAIN]
+ENDPOINT = {url}
+APIKEY = bench
+DEBUG = 0
+PREFETCH = vm
+[CACHE]
+DIR = {cache}
+"""
+# Slower than the baseline by this ratio, and by more than NOISE seconds
+TOLERANCE = 0.25
+NOISE = 0.005
+COMPLETIONS = 50  # Calls to average the time of a completion
+
+
+def timed(func, *args):
+    """Get the seconds a call took."""
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def measure(out_path):
+    """
+    Measure the shell, configured by the config.ini of the current
+    directory, and write the seconds of each step in out_path.
+    """
+    from gandishell.objects import VirtualMachine as VM
+    from gandishell.shell import GandiShell
+    res = {}
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), \
+            redirect_stderr(devnull):
+        res['startup'] = timed(GandiShell)
+        shell = GandiShell()
+        res['startup_cached'] = timed(GandiShell)
+        count = len(shell.stored_objects[VM])
+        last = min(count, 100)
+        res['list'] = timed(shell.onecmd, 'vm list --jsonl')
+        res['info_100'] = timed(shell.onecmd, 'vm info 1-{}'.format(last))
+        res['reboot_100'] = timed(shell.onecmd,
+                                  'vm reboot 1-{}'.format(last))
+        res['complete'] = timed(lambda: [
+            shell.complete_vm('1', 'vm info 1', 8, 9)
+            for _ in range(COMPLETIONS)]) / COMPLETIONS
+        res['refresh'] = timed(shell.load_objects, [VM], True)
+    with open(out_path, 'w') as out:
+        json.dump(res, out)
+
+
+def measure_size(size, latency):
+    """Measure the shell in a new process, against a fleet of size VMs."""
+    fake = FakeGandi(size, latency, step_seconds=0)
+    url = fake.start()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'config.ini'), 'w') as config:
+                config.write(CONFIG.format(url=url, cache=os.path.join(
+                    tmp, 'cache')))
+            out_path = os.path.join(tmp, 'res.json')
+            subprocess.check_call(
+                [sys.executable, '-W', 'ignore', '-c',
+                 'import sys; from tests.bench_scale import measure; '
+                 'measure(sys.argv[1])', out_path],
+                cwd=tmp, env=dict(os.environ, PYTHONPATH=root))
+            with open(out_path) as res:
+                return json.load(res)
+    finally:
+        fake.stop()
+
+
+def compare(seconds, before, tolerance):
+    """Get a note comparing seconds with the baseline."""
+    if before is None:
+        return '', False
+    change = (seconds - before) / before if before else 0
+    regression = change > tolerance and seconds - before > NOISE
+    return '{:+.0%}{}'.format(change, ' REGRESSION' if regression else ''), \
+        regression
+
+
+def run_bench_scale():
+    """Run the benchmarks at each size, and report the regressions."""
+    parser = ArgumentParser(description=run_bench_scale.__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help="seconds the fake API takes by request")
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save', action='store_true',
+                        help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        baseline = {}
+    results, regressions = {}, []
+    print("{:>7} {:<16} {:>10} {:>10}  {}".format(
+        'VMs', 'step', 'seconds', 'baseline', 'change'))
+    for size in args.sizes:
+        results[str(size)] = measure_size(size, args.latency)
+        for step, seconds in results[str(size)].items():
+            before = baseline.get(str(size), {}).get(step)
+            note, regression = compare(seconds, before, args.tolerance)
+            if regression:
+                regressions.append((size, step))
+            print("{:>7} {:<16} {:>10.4f} {:>10}  {}".format(
+                size, step, seconds,
+                '-' if before is None else '{:.4f}'.format(before), note))
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print("Baseline saved in {}".format(args.baseline))
+    if regressions:
+        print("{} regressions: {}".format(len(regressions), ', '.join(
+            '{} at {} VMs'.format(step, size) for size, step in regressions)))
+        sys.exit(1)
@@ -0,0 +1,143 @@
+# coding: utf-8
+"""Benchmarks of gandishell internals, to run from the project directory."""
+
+import asyncio
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from xmlrpc.client import ServerProxy, dumps
+from xmlrpc.client import getparser as xmlrpc_getparser
+
+from gandishell.aio import AsyncProxy, AsyncTransport
+from gandishell.decode import getparser
+from gandishell.objects import Operation, VirtualMachine
+from gandishell.transport import READ_SIZE, PooledTransport
+from gandishell.utils import APIKEY, WORKERS
+
+from tests.fake_gandi import FakeGandi
+
+
+class LegacyOperation(dict):
+    """An Operation stored like before, in a dict subclass."""
+
+
+def operation_payload(i):
+    """Get an operation like the ones returned by operation.list."""
+    return {'id': i, 'date_created': datetime(2014, 1, 1),
+            'date_updated': datetime(2014, 1, 2),
+            'date_start': datetime(2014, 1, 1), 'eta': 0,
+            'last_error': '', 'source': 'AB1234-GANDI', 'step': 'DONE',
+            'type': 'vm_reboot', 'vm_id': i % 500, 'disk_id': None,
+            'iface_id': None, 'ip_id': None}
+
+
+def measure_memory(factory, payloads):
+    """Get the memory allocated to build objects from the payloads."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [factory(**payload) for payload in payloads]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objs
+    return size
+
+
+def run_bench_memory(count=10000):
+    """Compare the memory used by many stored objects, before and after."""
+    payloads = [operation_payload(i) for i in range(count)]
+    before = measure_memory(LegacyOperation, payloads)
+    after = measure_memory(Operation, payloads)
+    print("Memory used by {:,} operations:".format(count))
+    print("  dict subclass: {:>12,} bytes".format(before))
+    print("  Record:        {:>12,} bytes ({:.0%})".format(after,
+                                                          after / before))
+
+
+def timed(func, *args):
+    """Get the result of a call, and the seconds it took."""
+    start = perf_counter()
+    res = func(*args)
+    return res, perf_counter() - start
+
+
+def run_bench_async(count=1000, latency=0.05):
+    """
+    Compare the ways to get info about many VMs from a stub server
+    answering after some latency: threads, multicall, and asyncio.
+    """
+    server = FakeGandi(count, latency)
+    url = server.start()
+    ids = list(range(1, count + 1))
+    api = ServerProxy(url, transport=PooledTransport('http', WORKERS),
+                      use_datetime=True)
+
+    def threads():
+        """One call by VM, on the threads of a pool."""
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            return list(pool.map(
+                lambda i: api.hosting.vm.info(APIKEY, i), ids))
+
+    async def aio(connections):
+        """One call by VM, all in flight on a single thread."""
+        proxy = AsyncProxy(url, AsyncTransport(url, connections))
+        try:
+            return (await VirtualMachine.afetch(proxy, ids))[0]
+        finally:
+            proxy.close()
+    print("Info about {:,} VMs, {:.0f} ms of latency:".format(
+        count, latency * 1000))
+    _, seconds = timed(threads)
+    print("  {} threads:          {:6.2f} s".format(WORKERS, seconds))
+    _, seconds = timed(VirtualMachine.fetch, api, ids)
+    print("  multicall:          {:6.2f} s".format(seconds))
+    for connections in [WORKERS, 64, 256]:
+        res, seconds = timed(asyncio.run, aio(connections))
+        assert len(res) == count
+        print("  asyncio, {:3} conns: {:6.2f} s".format(connections, seconds))
+    server.stop()
+
+
+def parse(parser, unmarshaller, body, size):
+    """Feed the body to the parser by chunks, like when it is downloaded."""
+    for start in range(0, len(body), size):
+        parser.feed(body[start:start + size])
+    parser.close()
+    return unmarshaller.close()[0]
+
+
+def decode_dicts(body):
+    """Decode a list response in dicts, then copy them in records."""
+    items = parse(*xmlrpc_getparser(use_datetime=True), body=body, size=1024)
+    return [Operation(**item) for item in items]
+
+
+def decode_records(body):
+    """Decode a list response straight into records."""
+    return parse(*getparser('operation.list', use_datetime=True), body=body,
+                 size=READ_SIZE)
+
+
+def measure_peak(func, *args):
+    """Get the result of a call, its seconds, and its peak of memory."""
+    tracemalloc.start()
+    res, seconds = timed(func, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, seconds, peak
+
+
+def run_bench_decode(count=50000):
+    """Compare the time and the memory used to decode a big list."""
+    body = dumps(([operation_payload(i) for i in range(count)],),
+                 methodresponse=True, allow_none=True).encode('utf-8')
+    print("Decoding operation.list of {:,} items ({:,} bytes):".format(
+        count, len(body)))
+    for name, func in [('dicts, then records', decode_dicts),
+                       ('records', decode_records)]:
+        timed(func, body)  # Warm up
+        _, seconds = timed(func, body)
+        res, _, peak = measure_peak(func, body)
+        assert len(res) == count and isinstance(res[0], Operation)
+        print("  {:20} {:6.2f} s, peak {:>12,} bytes".format(
+            name + ':', seconds, peak))
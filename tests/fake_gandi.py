@@ -0,0 +1,354 @@
+# coding: utf-8
+"""
+A local fake of the Gandi API, with a fleet of any size, answering after
+some latency. Operations go through a few steps before being DONE.
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from time import sleep, time
+from xmlrpc.client import Fault
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+DATE = datetime(2014, 1, 1)
+DATACENTERS = [{'id': 1, 'iso': 'FR', 'name': 'Equinix Paris'},
+               {'id': 2, 'iso': 'US', 'name': 'Level3 Baltimore'},
+               {'id': 3, 'iso': 'LU', 'name': 'Bissen'}]
+# Steps of the operations, each one lasting FakeGandi.step_seconds
+STEPS = ['BILL', 'WAIT', 'RUN', 'DONE']
+NOT_FOUND = 510042
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+    """Keep connections alive, like the real endpoint."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    """One thread by connection, and room for many waiting ones."""
+    daemon_threads = True
+    request_queue_size = 256
+    latency = 0
+
+    def _marshaled_dispatch(self, *args, **kwargs):
+        # Once by request, multicalls included
+        sleep(self.latency)
+        return super()._marshaled_dispatch(*args, **kwargs)
+
+
+def vm_payload(i):
+    """Get a VM like the ones returned by hosting.vm.list."""
+    return {'id': i, 'hostname': 'web-{:05}'.format(i), 'state': 'running',
+            'datacenter_id': 1 + i % 3, 'memory': 256, 'cores': 1,
+            'ai_active': 0, 'disks_id': [i], 'ifaces_id': [i],
+            'date_created': DATE, 'date_updated': DATE}
+
+
+def disk_payload(i, vm_id=None):
+    """Get a disk, the system disk of a VM if given."""
+    return {'id': i, 'name': 'sys_web{:05}'.format(i), 'size': 3072,
+            'state': 'created', 'type': 'data', 'datacenter_id': 1 + i % 3,
+            'vms_id': [] if vm_id is None else [vm_id],
+            'date_created': DATE, 'date_updated': DATE}
+
+
+def iface_payload(i, vm_id=None):
+    """Get an interface, of a VM if given."""
+    return {'id': i, 'vm_id': vm_id, 'ips_id': [i], 'state': 'used',
+            'type': 'public', 'bandwidth': 10240.0,
+            'datacenter_id': 1 + i % 3, 'date_created': DATE}
+
+
+def ip_payload(i):
+    """Get an IP address, of the interface of the same id."""
+    return {'id': i, 'ip': '10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255,
+                                                 i & 255),
+            'iface_id': i, 'version': 4, 'state': 'created',
+            'datacenter_id': 1 + i % 3, 'reverse': 'xvm-{}.ghst.net'.format(i),
+            'date_created': DATE}
+
+
+def image_payload(i):
+    """Get a disk image."""
+    system = ['Debian 7', 'Debian 8', 'Ubuntu 14.04', 'CentOS 7'][i % 4]
+    return {'id': i, 'label': '{} 64 bits'.format(system),
+            'os_arch': 'x86-64', 'kernel_version': '3.12-x86_64',
+            'datacenter_id': 1 + i % 3, 'disk_id': 100000 + i,
+            'visibility': 'all', 'date_created': DATE}
+
+
+# pylint: disable=R0904
+class FakeGandi(object):
+    """The objects of an account, served on localhost."""
+
+    def __init__(self, vms=100, latency=0.05, step_seconds=0.1):
+        self.latency = latency
+        self.step_seconds = step_seconds
+        self.lock = Lock()
+        self.vms = {i: vm_payload(i) for i in range(1, vms + 1)}
+        self.disks = {i: disk_payload(i, i) for i in self.vms}
+        self.ifaces = {i: iface_payload(i, i) for i in self.vms}
+        self.ips = {i: ip_payload(i) for i in self.vms}
+        self.images = {i: image_payload(i) for i in range(1, 25)}
+        self.operations = {}
+        self.starts = {}  # Start time of the operations, by id
+        self.server = None
+
+    ################# Serving ######################
+    def start(self, port=0):
+        """Serve in background, and return the url of the endpoint."""
+        self.server = Server(('127.0.0.1', port), Handler, logRequests=False,
+                             allow_none=True)
+        self.server.latency = self.latency
+        self.server.register_multicall_functions()
+        self.server.register_instance(self, allow_dotted_names=False)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _dispatch(self, method, params):
+        func = getattr(self, method.replace('.', '_'), None)
+        if func is None or method.startswith('_'):
+            raise Fault(1, "Unknown method {}".format(method))
+        with self.lock:
+            return func(*params[1:])  # Without the api key
+
+    ################# Helpers ######################
+    @staticmethod
+    def _get(objs, obj_id):
+        if obj_id not in objs:
+            raise Fault(NOT_FOUND, "Object {} not found".format(obj_id))
+        return objs[obj_id]
+
+    @staticmethod
+    def _filter(objs, options):
+        options = dict(options or {})
+        for key in ['items_per_page', 'page', 'sort_by']:
+            options.pop(key, None)
+        return [obj for _, obj in sorted(objs.items())
+                if all(obj.get(key) == value
+                       for key, value in options.items())]
+
+    def _page(self, objs, options):
+        options = options or {}
+        items = self._filter(objs, options)
+        sort = options.get('sort_by')
+        if sort:
+            key = sort.lstrip('-')
+            items.sort(key=lambda obj: (obj.get(key) is None, obj.get(key)),
+                       reverse=sort.startswith('-'))
+        size = options.get('items_per_page', 100)
+        page = options.get('page', 0)
+        return items[page * size:(page + 1) * size]
+
+    def _operation(self, kind, **related):
+        ope_id = len(self.operations) + 1
+        ope = {'id': ope_id, 'step': STEPS[0], 'type': kind,
+               'date_created': DATE, 'date_updated': DATE, 'eta': 0,
+               'last_error': '', 'source': 'AB1234-GANDI'}
+        for key in ['vm_id', 'disk_id', 'iface_id', 'ip_id']:
+            ope[key] = related.get(key)
+        self.operations[ope_id] = ope
+        self.starts[ope_id] = time()
+        return self._step(ope)
+
+    def _step(self, ope):
+        """Move an operation to its current step."""
+        step = len(STEPS) - 1
+        if self.step_seconds:
+            elapsed = time() - self.starts.get(ope['id'], 0)
+            step = min(step, int(elapsed / self.step_seconds))
+        ope['step'] = STEPS[step]
+        return ope
+
+    ################# Account ######################
+    def hosting_account_info(self):
+        """Get the account."""
+        return {'id': 1, 'fullname': 'John Doe', 'handle': 'JD1234-GANDI',
+                'credits': 123456, 'average_credit_cost': 0.0123,
+                'date_credits_expiration': DATE, 'products': [],
+                'share_definition': {}, 'rating_enabled': True,
+                'resources': {'available': {'cores': 1024},
+                              'used': {'cores': len(self.vms)}}}
+
+    def hosting_datacenter_list(self, options=None):
+        """List the datacenters."""
+        return self._page(dict(enumerate(DATACENTERS)), options)
+
+    ################# Disks ########################
+    def hosting_disk_count(self, options=None):
+        """Count the disks."""
+        return len(self._filter(self.disks, options))
+
+    def hosting_disk_list(self, options=None):
+        """List a page of disks."""
+        return self._page(self.disks, options)
+
+    def hosting_disk_info(self, disk_id):
+        """Get a disk."""
+        return self._get(self.disks, disk_id)
+
+    def hosting_disk_delete(self, disk_id):
+        """Delete a disk, not attached to a VM."""
+        if self._get(self.disks, disk_id)['vms_id']:
+            raise Fault(581042, "Disk {} is attached".format(disk_id))
+        del self.disks[disk_id]
+        return self._operation('disk_delete', disk_id=disk_id)
+
+    ################# Interfaces ###################
+    def hosting_iface_count(self, options=None):
+        """Count the interfaces."""
+        return len(self._filter(self.ifaces, options))
+
+    def hosting_iface_list(self, options=None):
+        """List a page of interfaces."""
+        return self._page(self.ifaces, options)
+
+    def hosting_iface_info(self, iface_id):
+        """Get an interface."""
+        return self._get(self.ifaces, iface_id)
+
+    ################# Images #######################
+    def hosting_image_list(self, options=None):
+        """List a page of images."""
+        return self._page(self.images, options)
+
+    def hosting_image_info(self, image_id):
+        """Get an image."""
+        return self._get(self.images, image_id)
+
+    ################# IPs ##########################
+    def hosting_ip_count(self, options=None):
+        """Count the IPs."""
+        return len(self._filter(self.ips, options))
+
+    def hosting_ip_list(self, options=None):
+        """List a page of IPs."""
+        return self._page(self.ips, options)
+
+    def hosting_ip_info(self, ip_id):
+        """Get an IP."""
+        return self._get(self.ips, ip_id)
+
+    ################# Operations ###################
+    def operation_count(self, options=None):
+        """Count the operations."""
+        return len(self._filter(self.operations, options))
+
+    def operation_list(self, options=None):
+        """List a page of operations."""
+        for ope in self.operations.values():
+            self._step(ope)
+        return self._page(self.operations, options)
+
+    def operation_info(self, ope_id):
+        """Get an operation."""
+        return self._step(self._get(self.operations, ope_id))
+
+    ################# VMs ##########################
+    def hosting_vm_count(self, options=None):
+        """Count the VMs."""
+        return len(self._filter(self.vms, options))
+
+    def hosting_vm_list(self, options=None):
+        """List a page of VMs."""
+        return self._page(self.vms, options)
+
+    def hosting_vm_info(self, vm_id):
+        """Get a VM, with its disks and interfaces."""
+        vmach = dict(self._get(self.vms, vm_id))
+        vmach['disks'] = [self.disks[i] for i in vmach['disks_id']
+                          if i in self.disks]
+        vmach['ifaces'] = [dict(self.ifaces[i], ips=[
+            self.ips[j] for j in self.ifaces[i]['ips_id'] if j in self.ips])
+                           for i in vmach['ifaces_id'] if i in self.ifaces]
+        return vmach
+
+    def _vm_state(self, vm_id, state, kind):
+        self._get(self.vms, vm_id)['state'] = state
+        return self._operation(kind, vm_id=vm_id)
+
+    def hosting_vm_start(self, vm_id):
+        """Start a VM."""
+        return self._vm_state(vm_id, 'running', 'vm_start')
+
+    def hosting_vm_stop(self, vm_id):
+        """Stop a VM."""
+        return self._vm_state(vm_id, 'halted', 'vm_stop')
+
+    def hosting_vm_reboot(self, vm_id):
+        """Reboot a VM."""
+        return self._vm_state(vm_id, 'running', 'vm_reboot')
+
+    def hosting_vm_delete(self, vm_id):
+        """Delete a VM, and detach its disks."""
+        vmach = self._get(self.vms, vm_id)
+        for disk_id in vmach['disks_id']:
+            if disk_id in self.disks:
+                self.disks[disk_id]['vms_id'] = []
+        del self.vms[vm_id]
+        return self._operation('vm_delete', vm_id=vm_id)
+
+    def hosting_vm_disk_attach(self, vm_id, disk_id):
+        """Attach a disk to a VM."""
+        vmach, disk = self._get(self.vms, vm_id), self._get(self.disks,
+                                                           disk_id)
+        vmach['disks_id'] = vmach['disks_id'] + [disk_id]
+        disk['vms_id'] = [vm_id]
+        return self._operation('disk_attach', vm_id=vm_id, disk_id=disk_id)
+
+    def hosting_vm_disk_detach(self, vm_id, disk_id):
+        """Detach a disk from a VM."""
+        vmach, disk = self._get(self.vms, vm_id), self._get(self.disks,
+                                                           disk_id)
+        vmach['disks_id'] = [i for i in vmach['disks_id'] if i != disk_id]
+        disk['vms_id'] = []
+        return self._operation('disk_detach', vm_id=vm_id, disk_id=disk_id)
+
+    def hosting_vm_create_from(self, vm_spec, disk_spec, src_disk_id):
+        """
+        Create a VM, with a system disk copied from an image disk. Like the
+        real API, return the operations creating the disk, the iface and
+        the VM.
+        """
+        if not any(image['disk_id'] == src_disk_id
+                   for image in self.images.values()):
+            raise Fault(NOT_FOUND, "Disk {} not found".format(src_disk_id))
+        vm_id = max(self.vms or [0]) + 1
+        disk_id = max(self.disks or [0]) + 1
+        self.disks[disk_id] = dict(disk_payload(disk_id, vm_id),
+                                   name=disk_spec['name'])
+        self.ifaces[vm_id] = iface_payload(vm_id, vm_id)
+        self.ips[vm_id] = ip_payload(vm_id)
+        self.vms[vm_id] = dict(
+            vm_payload(vm_id), disks_id=[disk_id], **{
+                key: vm_spec[key] for key in ['hostname', 'memory', 'cores',
+                                              'datacenter_id']})
+        return [self._operation('disk_create', disk_id=disk_id),
+                self._operation('iface_create', iface_id=vm_id, vm_id=vm_id),
+                self._operation('vm_create', vm_id=vm_id, disk_id=disk_id)]
+
+
+def run_fake_gandi():
+    """Serve a fake API until interrupted, to try the shell with it."""
+    parser = ArgumentParser(description=run_fake_gandi.__doc__)
+    parser.add_argument('--port', type=int, default=8777)
+    parser.add_argument('--vms', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    fake = FakeGandi(args.vms, args.latency)
+    print("Serving {} VMs on {}".format(args.vms, fake.start(args.port)))
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,117 @@
+# coding: utf-8
+"""Check the records decoded from responses against xmlrpc.client."""
+
+import unittest
+from datetime import datetime
+from xmlrpc.client import Fault, dumps, loads
+
+from gandishell.decode import getparser
+from gandishell.objects import Account, Disk, VirtualMachine
+
+
+def vm_payload(i):
+    """Get a VM like the ones returned by hosting.vm.list."""
+    return {'id': i, 'hostname': 'web-{:02}'.format(i), 'state': 'running',
+            'memory': 256, 'cores': 1, 'datacenter_id': 1,
+            'disks_id': [i], 'ifaces_id': [i], 'ai_active': 0,
+            'date_created': datetime(2014, 1, 1, 12, 30),
+            'date_updated': datetime(2014, 1, 2)}
+
+
+def vm_info_payload(i):
+    """Get a VM like the ones returned by hosting.vm.info."""
+    payload = vm_payload(i)
+    payload['disks'] = [{'id': i, 'name': 'sys', 'size': 3072,
+                         'vms_id': [i], 'date_created': datetime(2014, 1, 1)}]
+    payload['ifaces'] = [{'id': i, 'vm_id': i, 'ips': [
+        {'id': i, 'ip': '10.0.0.{}'.format(i), 'version': 4}]}]
+    return payload
+
+
+def response(result):
+    """Get the body of a response returning result, or a Fault."""
+    if isinstance(result, Fault):
+        return dumps(result, methodresponse=True)
+    return dumps((result,), methodresponse=True, allow_none=True)
+
+
+def decode(method, body):
+    """Decode a response body as the client does for this method."""
+    parser, unmarshaller = getparser(method, use_datetime=True)
+    parser.feed(body.encode('utf-8'))
+    parser.close()
+    return unmarshaller.close()
+
+
+class DecodeTest(unittest.TestCase):
+    """RecordUnmarshaller gets the same data as xmlrpc.client.loads."""
+
+    def check(self, method, result):
+        """Decode the response of a method, and compare it to loads."""
+        body = response(result)
+        decoded = decode(method, body)
+        self.assertEqual(decoded, loads(body, use_datetime=True)[0])
+        return decoded[0]
+
+    def test_list(self):
+        vms = self.check('hosting.vm.list', [vm_payload(i)
+                                             for i in range(1, 4)])
+        for vm in vms:
+            self.assertIsInstance(vm, VirtualMachine)
+        self.assertEqual(vms[0]['date_created'], datetime(2014, 1, 1, 12, 30))
+
+    def test_empty_list(self):
+        self.assertEqual(self.check('hosting.disk.list', []), [])
+
+    def test_info(self):
+        vm = self.check('hosting.vm.info', vm_info_payload(7))
+        self.assertIsInstance(vm, VirtualMachine)
+        # Only the structs at the depth of the type are records
+        self.assertIs(type(vm['disks'][0]), dict)
+        self.assertIs(type(vm['ifaces'][0]['ips'][0]), dict)
+
+    def test_info_drops_hidden_keys(self):
+        payload = {'id': 1, 'fullname': 'John Doe', 'credits': 42,
+                   'products': [{'id': 3}], 'rating_enabled': True}
+        body = response(payload)
+        account = decode('hosting.account.info', body)[0]
+        self.assertIsInstance(account, Account)
+        self.assertEqual(account, {'id': 1, 'fullname': 'John Doe',
+                                   'credits': 42})
+
+    def test_multicall(self):
+        results = [[vm_info_payload(i)] for i in range(1, 4)]
+        vms = self.check('system.multicall:hosting.vm.info', results)
+        for (vm,) in vms:
+            self.assertIsInstance(vm, VirtualMachine)
+
+    def test_multicall_faults(self):
+        fault = {'faultCode': 510042, 'faultString': 'Object 2 not found'}
+        results = self.check('system.multicall:hosting.vm.info',
+                             [[vm_info_payload(1)], fault])
+        self.assertIsInstance(results[0][0], VirtualMachine)
+        self.assertIs(type(results[1]), dict)
+
+    def test_fault(self):
+        body = response(Fault(510042, 'Object 2 not found'))
+        with self.assertRaises(Fault) as expected:
+            loads(body)
+        with self.assertRaises(Fault) as raised:
+            decode('hosting.disk.info', body)
+        self.assertEqual(raised.exception.faultCode,
+                         expected.exception.faultCode)
+        self.assertEqual(raised.exception.faultString,
+                         expected.exception.faultString)
+
+    def test_unregistered(self):
+        result = {'api_version': '3.3.42', 'date': datetime(2014, 1, 1)}
+        self.assertIs(type(self.check('version.info', result)), dict)
+
+    def test_other_type(self):
+        disk = self.check('hosting.disk.info', {'id': 1, 'name': 'sys',
+                                                'vms_id': []})
+        self.assertIsInstance(disk, Disk)
+
+
+if __name__ == '__main__':
+    unittest.main()